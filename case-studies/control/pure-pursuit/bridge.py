@@ -0,0 +1,275 @@
+'''
+Socket bridge between the controllers and an external plant process
+
+Wheel commands and poses are exchanged as compact binary messages over a
+UNIX or TCP socket. Each message is a fixed header followed by one row of
+doubles per robot, so that a whole fleet is served by a single message in
+each direction. Messages are packed into preallocated buffers and the
+payloads are read and written through numpy views of these buffers, without
+any per-message allocation.
+
+Message layout (little endian):
+  - header: kind (uint16), number of robots n (uint16), sequence number
+            (uint32), time (double), time step (double)
+  - payload: n rows of (right, left) wheel angular speeds for a command,
+             n rows of (x, y, theta) for a pose
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+from plant import Cart, CartFleet
+import multiprocessing
+import socket
+import struct
+
+HEADER = struct.Struct("<HHIdd")
+
+# Message kinds, with the number of doubles per robot in their payload
+CMD = 1
+POSE = 2
+ROW_SIZE = {CMD: 2, POSE: 3}
+
+class Message:
+    ''' Preallocated message of a given kind for n robots
+
+        Detail:
+          payload is a (n, k) numpy view of the message buffer: writing to
+          it fills the message, and receiving into view updates it
+
+        Inputs:
+          - kind: CMD or POSE
+          - n: number of robots
+    '''
+    def __init__(self, kind, n=1):
+        self.kind = kind
+        self.n = n
+        self.buffer = bytearray(HEADER.size + 8*n*ROW_SIZE[kind])
+        self.view = memoryview(self.buffer)
+        self.payload = np.frombuffer(self.buffer,
+                                     dtype="<f8",
+                                     offset=HEADER.size).reshape(n, -1)
+        self.seq = 0
+        self.t = 0.
+        self.dt = 0.
+
+    def pack(self, seq, t, dt=0.):
+        ''' Write the header, the payload being already in place
+
+            Output:
+              - view: memoryview of the whole message
+        '''
+        HEADER.pack_into(self.buffer, 0, self.kind, self.n, seq, t, dt)
+        return self.view
+
+    def unpack(self):
+        ''' Check and decode the header of a received message
+        '''
+        (kind, n, self.seq, self.t, self.dt) = HEADER.unpack_from(self.buffer)
+        if kind!=self.kind or n!=self.n:
+            raise ValueError("Unexpected message: kind {}, {} robots"
+                             .format(kind, n))
+
+def send_msg(sock, msg, seq, t, dt=0.):
+    ''' Send a message whose payload is filled
+    '''
+    sock.sendall(msg.pack(seq, t, dt))
+
+def recv_msg(sock, msg):
+    ''' Receive a whole message into msg
+
+        Output:
+          - ok: False if the peer closed the connection
+    '''
+    view = msg.view
+    size = len(view)
+    received = 0
+    while received<size:
+        n = sock.recv_into(view[received:], size - received)
+        if n==0:
+            return False
+        received += n
+    msg.unpack()
+
+    return True
+
+def open_socket(address):
+    ''' Socket matching address, (host, port) or a UNIX socket path
+    '''
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class Bridge:
+    ''' Client side of the bridge
+
+        Detail:
+          Each exchange sends the commands of all the robots in one message
+          and waits for the poses that follow them
+
+        Inputs:
+          - address: (host, port) or UNIX socket path of the plant server
+          - n: number of robots
+    '''
+    def __init__(self, address, n=1):
+        self.n = n
+        self.cmd = Message(CMD, n)
+        self.pose = Message(POSE, n)
+        self.seq = 0
+
+        self.sock = open_socket(address)
+        self.sock.connect(address)
+
+    def exchange(self, u, t, dt):
+        ''' Send wheel commands, receive the resulting poses
+
+            Inputs:
+              - u: wheel angular speeds, (2,) or (n, 2)
+              - t: time of the command
+              - dt: duration of the command
+
+            Output:
+              - poses: (n, 3) view of the received poses, overwritten by the
+                       next exchange
+        '''
+        self.cmd.payload[:] = u
+        send_msg(self.sock, self.cmd, self.seq, t, dt)
+        if not recv_msg(self.sock, self.pose):
+            raise ConnectionError("Plant server disconnected")
+        self.seq += 1
+
+        return self.pose.payload
+
+    def close(self):
+        self.sock.close()
+
+
+class BridgeCart(Cart):
+    ''' Cart whose motion is computed by a plant server, through a Bridge
+
+        Inputs:
+          - address: address of the plant server
+          - p0, L, r: as for Cart. They must match the server's
+    '''
+    def __init__(self, address, p0=[0., 0., 0.], L=1.0, r=1.0):
+        Cart.__init__(self, p0, L, r)
+        self.bridge = Bridge(address, 1)
+
+    def step(self, u, dt):
+        self.p_prev = self.p
+        self.u = u
+        self.dt = dt
+        self.p = self.bridge.exchange(u, self.t, dt)[0].copy()
+        self.t += dt
+
+
+class BridgeFleet(CartFleet):
+    ''' CartFleet whose motion is computed by a plant server, with one
+        message per step for the whole fleet
+
+        Inputs:
+          - address: address of the plant server
+          - p0, L, r: as for CartFleet. They must match the server's
+    '''
+    def __init__(self, address, p0=[[0., 0., 0.]], L=1.0, r=1.0):
+        CartFleet.__init__(self, p0, L, r)
+        self.bridge = Bridge(address, self.n)
+
+    def step(self, u, dt):
+        self.p_prev = self.p
+        self.u = u
+        self.dt = dt
+        self.p = self.bridge.exchange(u, self.t, dt).copy()
+        self.t += dt
+
+
+def serve_plant(address, fleet, ready=None):
+    ''' Serve one client: step fleet with each command message and reply with
+        the poses
+
+        Inputs:
+          - address: (host, port) or UNIX socket path
+          - fleet: simulated robots, a CartFleet
+          - ready: multiprocessing.Event set once listening
+    '''
+    cmd = Message(CMD, fleet.n)
+    pose = Message(POSE, fleet.n)
+
+    server = open_socket(address)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(address)
+    server.listen(1)
+    if ready is not None:
+        ready.set()
+
+    (sock, _) = server.accept()
+    if not isinstance(address, str):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        while recv_msg(sock, cmd):
+            fleet.step(cmd.payload, cmd.dt)
+            pose.payload[:] = fleet.p
+            send_msg(sock, pose, cmd.seq, fleet.t)
+    finally:
+        sock.close()
+        server.close()
+
+def run_plant(address, p0, L=1.0, r=1.0, ready=None):
+    ''' Entry point of the plant server process
+    '''
+    serve_plant(address, CartFleet(p0=p0, L=L, r=r), ready)
+
+def start_plant(address, p0, L=1.0, r=1.0):
+    ''' Start a plant server process and wait until it is listening
+
+        Inputs:
+          - address: (host, port) or UNIX socket path
+          - p0: initial states, [x, y, theta] or a list of them for a fleet
+
+        Output:
+          - process: the server's multiprocessing.Process
+    '''
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_plant,
+                                      args=(address, p0, L, r, ready),
+                                      daemon=True)
+    process.start()
+    ready.wait()
+
+    return process
+
+
+if __name__=="__main__":
+    from simulator import Simulator
+    from controller import ClosedLoopCtrl
+    import os, tempfile
+
+    address = os.path.join(tempfile.mkdtemp(), "plant.sock")
+    p0 = [-3., 5., -pi/4]
+    path=[(0.0, 0.0),
+          (4.0, 0.0),
+          (3.0, -3.0),
+          (1.0, -2.0),
+          (-2.0, 0.0)]
+
+    plant = start_plant(address, p0)
+    cart = BridgeCart(address, p0=p0)
+    sim = Simulator(cart,
+                    controller=ClosedLoopCtrl(cart, reference=path),
+                    headless=True,
+                    timing=True)
+    sim.run(dt=0.01)
+    cart.bridge.close()
+    plant.join()
+    os.remove(address)
+
+    print(sim.stats)
@@ -13,6 +13,9 @@ license: GNU GPL
 #!/usr/bin/env python
 
 from lib import *
+from pathindex import PathIndex
+from telemetry import EventChannel, CONTROLLER_LAUNCHED, NEW_TARGET, \
+                      FINAL_TARGET
 
 class OpenLoopCtrl:
     ''' Open loop controller definition
@@ -23,7 +26,8 @@ class OpenLoopCtrl:
           - reference: sequence of command inputs (w_r, w_l) where w_r, w_l are
                        respectively the right and left wheel angular speeds. Must
                        be specified as a dictionnary of tuples indexed with the
-                       time each specific command ends.
+                       time each specific command ends, or, for long
+                       schedules, as an array of rows (t_end, w_r, w_l).
     '''
     def __init__(self,
                  cart,
@@ -36,11 +40,25 @@ class OpenLoopCtrl:
         self.r = cart.r
         self.is_end = False
 
-        if len(reference)>0:
+        # Schedule as sorted arrays: command k applies on
+        # [commands_ts[k-1], commands_ts[k])
+        if isinstance(reference, dict):
             self.commands = reference
-            self.commands_ts = sorted(list(self.commands.keys()))
+            self.commands_ts = array(sorted(reference.keys()), dtype="float")
+            speeds = array([reference[t] for t in self.commands_ts],
+                           dtype="float").reshape(-1, 2)
+        else:
+            schedule = asarray(reference, dtype="float").reshape(-1, 3)
+            schedule = schedule[np.argsort(schedule[:,0], kind="stable")]
+            self.commands_ts = schedule[:,0]
+            speeds = schedule[:,1:]
+            self.commands = dict(zip(self.commands_ts, map(tuple, speeds)))
+        self.wheel_cmds = np.column_stack(self.transform(speeds[:,0],
+                                                         speeds[:,1]))
+
+        self.cmd_idx = 0
+        if len(reference)>0:
             self.current_cmd_end = self.commands_ts[0]
-            self.cmd_idx = 0
             self.t_end = self.commands_ts[-1]
         else:
             self.t_end = 0.0
@@ -53,13 +71,44 @@ class OpenLoopCtrl:
 
         return (u0, u1)
 
+    def index_at(self, t):
+        ''' Index of the command applied at time t, found by binary search.
+            Any t can be queried, in any order
+        '''
+        return int(np.searchsorted(self.commands_ts, t, side="right"))
+
+    def interval(self, t):
+        ''' Command applied at time t and its validity interval
+
+            Output:
+              - t_start, t_stop: boundaries of the interval over which the
+                                 command is applied. t_stop is inf after the
+                                 end of the schedule
+              - u: wheel angular speeds
+        '''
+        k = self.index_at(t)
+        if t>=self.t_end:
+            return (self.t_end, np.inf, (0., 0.))
+
+        t_start = float(self.commands_ts[k-1]) if k>0 else -np.inf
+        return (t_start,
+                float(self.commands_ts[k]),
+                tuple(self.wheel_cmds[k].tolist()))
+
+    def switch_times(self, t0, t1):
+        ''' Times of the command changes within the interval (t0, t1), to
+            split an integration step
+        '''
+        i0 = np.searchsorted(self.commands_ts, t0, side="right")
+        i1 = np.searchsorted(self.commands_ts, t1, side="left")
+
+        return self.commands_ts[i0:i1]
+
     def generate_cmd(self, p, t):
         if t<self.t_end:
-            if t>self.current_cmd_end:
-                self.cmd_idx += 1
-                self.current_cmd_end = self.commands_ts[self.cmd_idx]
-            u = self.transform(self.commands[self.current_cmd_end][0],
-                               self.commands[self.current_cmd_end][1])
+            self.cmd_idx = self.index_at(t)
+            self.current_cmd_end = self.commands_ts[self.cmd_idx]
+            u = tuple(self.wheel_cmds[self.cmd_idx].tolist())
         else:
             u = (0, 0)
             self.is_end = True
@@ -75,16 +124,32 @@ class ClosedLoopCtrl:
                   command generation
           - reference: sequence of (x, y) waypoints. Must be specified as a
                        list of tuples.
+          - K: heading proportional gain
+          - v: cruise linear speed
+          - wp_tol: distance under which a waypoint is considered reached
+          - lookahead: if specified, the guidance targets the point of the
+                       path at this distance ahead of the cart, instead of
+                       the current waypoint. The closest path segment is
+                       tracked with a PathIndex built once for the path,
+                       starting from the first segment and only moving
+                       forward (see PathIndex.advance), so that waypoints
+                       are never skipped by matching a later part of the
+                       path
     '''
     def __init__(self,
                  cart,
                  reference=[(2.0, 0.0),
                             (3.0, -1.0),
-                            (0.0, 0.0)]):
+                            (0.0, 0.0)],
+                 K=2.,
+                 v=2.,
+                 wp_tol=0.2,
+                 lookahead=None):
         self.type = "closed-loop"
         self.path = reference
-        self.K = 2.
-        self.v = 2.
+        self.K = K
+        self.v = v
+        self.wp_tol = wp_tol
         self.L = cart.L
         self.r = cart.r
         self.is_end = False
@@ -92,18 +157,34 @@ class ClosedLoopCtrl:
         self.wp_idx = 1
         self.current_wp = self.path[0]
 
-        print("\nController launched")
-        print("  Path composed of {} waypoints".format(len(self.path)))
-        print("\nInitial target: {}. {}".format(self.wp_idx-1,
-                                              self.current_wp))
+        self.lookahead = lookahead
+        if lookahead is not None:
+            self.index = PathIndex(self.path)
+            self.seg_idx = 0 # Closest segment at the previous step
+            self.target = self.current_wp
+
+        self.t = 0.
+        self.telemetry = EventChannel()
+        self.telemetry.emit(CONTROLLER_LAUNCHED, index=len(self.path))
+        self.telemetry.emit(NEW_TARGET,
+                            t=self.t,
+                            index=self.wp_idx-1,
+                            x=self.current_wp[0],
+                            y=self.current_wp[1])
 
     def generate_cmd(self, p, t):
         ''' Main function to generate the current wheel angular speed inputs
         '''
+        self.t = t
+        if self.lookahead is not None and not self.is_end:
+            self.target = self.track(p)
         self.current_wp = self.supervise(p)
 
         if not self.is_end:
-            th_err = self.LOS(p, self.current_wp)
+            if self.lookahead is None:
+                th_err = self.LOS(p, self.current_wp)
+            else:
+                th_err = self.LOS(p, self.target)
 
             v = self.v
             w = self.P(self.K, th_err)
@@ -122,19 +203,60 @@ class ClosedLoopCtrl:
 
         dist = sqrt(pow(p[0]-current_wp[0],2)
                     +pow(p[1]-current_wp[1],2))
-        if dist<0.2:
+        if dist<self.wp_tol:
             if self.wp_idx<len(self.path):
                 self.wp_idx += 1
                 current_wp = self.path[self.wp_idx-1]
-                print("New target: {}. {}".format(self.wp_idx-1,
-                                                  self.current_wp))
+                self.telemetry.emit(NEW_TARGET,
+                                    t=self.t,
+                                    index=self.wp_idx-1,
+                                    x=current_wp[0],
+                                    y=current_wp[1])
             elif not self.is_end:
                 self.is_end = True
                 current_wp = None
-                print("\nFinal target reached\n")
+                self.telemetry.emit(FINAL_TARGET, t=self.t)
 
         return current_wp
 
+    def target_zone(self):
+        ''' Disc whose entry triggers the next waypoint switch, None once
+            the path is complete
+        '''
+        if self.is_end:
+            return None
+        return (self.current_wp, self.wp_tol)
+
+    def track(self, p):
+        ''' Match the closest path segment and compute the lookahead point
+
+            Detail:
+              Until the first waypoint is reached, it is targeted directly,
+              so that the cart joins the path at its start. Then the waypoint
+              ending the matched segment becomes the current waypoint if it
+              is ahead of it, so that waypoints bypassed by the lookahead
+              guidance do not block the supervisor
+        '''
+        if self.wp_idx==1: # Start of the path not reached yet
+            return self.current_wp
+
+        q = p[:2]
+        (i, t, dist) = self.index.advance(q, self.seg_idx)
+        self.seg_idx = i
+
+        if i+2>self.wp_idx:
+            self.wp_idx = i+2
+            self.current_wp = self.path[i+1]
+            self.telemetry.emit(NEW_TARGET,
+                                t=self.t,
+                                index=self.wp_idx-1,
+                                x=self.current_wp[0],
+                                y=self.current_wp[1])
+
+        (j, t) = self.index.lookahead(q, i, t, self.lookahead)
+
+        return self.index.point(j, t)
+
     def LOS(self, p, wp):
         ''' Guidance law to generate the heading reference
         '''
@@ -155,3 +277,260 @@ class ClosedLoopCtrl:
         u1 = (2*v - self.L*w) / (2*self.r)
 
         return (u0, u1)
+
+
+class PurePursuitCtrl:
+    ''' Pure pursuit controller definition
+
+        Detail:
+          The cumulative arc length, headings and unit vectors of the path
+          segments are computed once, in a PathIndex. The cart first heads
+          for the first waypoint. From there, the closest point of the path
+          is tracked forward only (see PathIndex.advance), the lookahead
+          point is found at the lookahead arc length past it by binary search
+          on the arc length array, and the curvature of the circle joining
+          the cart to the lookahead point tangentially to its heading is
+          applied: kappa = 2*sin(alpha)/d, with alpha the bearing of the
+          lookahead point and d its distance.
+
+        Inputs:
+          - cart: Model object. Model parameters are used in the
+                  command generation
+          - reference: sequence of (x, y) waypoints. Must be specified as a
+                       list of tuples.
+          - v: cruise linear speed
+          - lookahead: lookahead distance, along the path
+          - wp_tol: distance to the first waypoint under which the path is
+                    joined, and to the final waypoint under which the path
+                    is considered complete
+    '''
+    def __init__(self,
+                 cart,
+                 reference=[(2.0, 0.0),
+                            (3.0, -1.0),
+                            (0.0, 0.0)],
+                 v=2.,
+                 lookahead=1.,
+                 wp_tol=0.2):
+        self.type = "pure-pursuit"
+        self.path = reference
+        self.v = v
+        self.lookahead = lookahead
+        self.wp_tol = wp_tol
+        self.L = cart.L
+        self.r = cart.r
+        self.is_end = False
+
+        self.index = PathIndex(self.path)
+        self.seg_idx = 0 # Closest segment at the previous step
+        self.s_proj = 0. # Arc length of the closest point
+        self.wp_idx = 1
+        self.target = self.index.points[0]
+
+        self.t = 0.
+        self.telemetry = EventChannel()
+        self.telemetry.emit(CONTROLLER_LAUNCHED, index=len(self.path))
+        self.telemetry.emit(NEW_TARGET,
+                            t=self.t,
+                            index=0,
+                            x=self.target[0],
+                            y=self.target[1])
+
+    def generate_cmd(self, p, t):
+        ''' Main function to generate the current wheel angular speed inputs
+        '''
+        self.t = t
+        self.supervise(p)
+
+        if not self.is_end:
+            if self.wp_idx==1: # Start of the path not reached yet
+                (self.target, i) = (self.index.points[0], 0)
+            else:
+                (self.target, i) = self.index.point_at(self.s_proj
+                                                       + self.lookahead)
+            v = self.v
+            w = v*self.curvature(p, self.target, i)
+        else:
+            v = 0
+            w = 0
+        (u0, u1) = self.transform(v, w)
+
+        return (u0, u1)
+
+    def supervise(self, p):
+        ''' Supervisor tracking the closest point of the path and handling
+            the simulation end
+        '''
+        if self.wp_idx==1:
+            start = self.index.points[0]
+            if np.hypot(p[0]-start[0], p[1]-start[1])>=self.wp_tol:
+                return
+            self.switch_wp(2)
+
+        (i, t, dist) = self.index.advance(p[:2], self.seg_idx)
+        self.seg_idx = i
+        self.s_proj = self.index.arc_length(i, t)
+        if i+2>self.wp_idx:
+            self.switch_wp(i+2)
+
+        end = self.index.points[-1]
+        if (not self.is_end
+            and self.s_proj>=self.index.s[-1] - self.lookahead
+            and np.hypot(p[0]-end[0], p[1]-end[1])<self.wp_tol):
+            self.is_end = True
+            self.telemetry.emit(FINAL_TARGET, t=self.t)
+
+    def switch_wp(self, wp_idx):
+        ''' Record the waypoint ending the tracked segment
+        '''
+        self.wp_idx = wp_idx
+        wp = self.index.points[wp_idx-1]
+        self.telemetry.emit(NEW_TARGET,
+                            t=self.t,
+                            index=wp_idx-1,
+                            x=wp[0],
+                            y=wp[1])
+
+    def target_zone(self):
+        ''' Disc around the first waypoint until the path is joined, then
+            around the final waypoint. None once the path is complete
+        '''
+        if self.is_end:
+            return None
+        if self.wp_idx==1:
+            return (self.index.points[0], self.wp_tol)
+        return (self.index.points[-1], self.wp_tol)
+
+    def curvature(self, p, target, i):
+        ''' Curvature of the arc joining the cart to the target point
+
+            Detail:
+              When the target is too close for its bearing to be defined,
+              the heading of segment i is used instead
+        '''
+        dx = target[0] - p[0]
+        dy = target[1] - p[1]
+        d = np.hypot(dx, dy)
+        if d<1e-6:
+            d = self.lookahead
+            alpha = normalize(self.index.heading[i] - p[2])
+        else:
+            alpha = normalize(arctan2(dy, dx) - p[2])
+
+        return 2*sin(alpha)/d
+
+    def transform(self, v, w):
+        ''' Transform linear and angular speed into wheel angular speeds
+        '''
+        u0 = (2*v + self.L*w) / (2*self.r)
+        u1 = (2*v - self.L*w) / (2*self.r)
+
+        return (u0, u1)
+
+
+class ClosedLoopFleetCtrl:
+    ''' Batched closed loop controller for a CartFleet
+
+        Detail:
+          Same LOS guidance and P heading control as ClosedLoopCtrl, computed
+          for all the carts of the fleet in a single call
+
+        Inputs:
+          - fleet: CartFleet object. Model parameters are used in the
+                   command generation
+          - reference: sequence of (x, y) waypoints shared by all the carts,
+                       or one such sequence per cart (same length for all)
+          - K: heading proportional gain
+          - v: cruise linear speed
+          - wp_tol: distance under which a waypoint is considered reached
+    '''
+    def __init__(self,
+                 fleet,
+                 reference=[(2.0, 0.0),
+                            (3.0, -1.0),
+                            (0.0, 0.0)],
+                 K=2.,
+                 v=2.,
+                 wp_tol=0.2):
+        self.type = "closed-loop-fleet"
+        self.n = fleet.n
+
+        path = asarray(reference, dtype="float")
+        if path.ndim==2:
+            path = np.broadcast_to(path, (self.n,) + path.shape)
+        self.path = path
+
+        self.K = K
+        self.v = v
+        self.wp_tol = wp_tol
+        self.L = fleet.L
+        self.r = fleet.r
+
+        self.wp_idx = np.ones(self.n, dtype=int)
+        self.done = np.zeros(self.n, dtype=bool)
+        self.is_end = False
+
+    @property
+    def current_wp(self):
+        ''' Current target waypoint of each cart, as a (N, 2) array
+        '''
+        return self.path[np.arange(self.n), self.wp_idx-1]
+
+    def generate_cmd(self, p, t):
+        ''' Generate the (N, 2) array of wheel angular speed inputs
+        '''
+        self.supervise(p)
+
+        th_err = self.LOS(p, self.current_wp)
+
+        v = np.where(self.done, 0., self.v)
+        w = np.where(self.done, 0., self.P(self.K, th_err))
+
+        return self.transform(v, w)
+
+    def supervise(self, p):
+        ''' Supervisor handling waypoint switching and simulation end
+        '''
+        wp = self.current_wp
+        dist = np.hypot(p[:,0]-wp[:,0], p[:,1]-wp[:,1])
+
+        reached = (dist<self.wp_tol) & ~self.done
+        last = self.wp_idx==self.path.shape[1]
+        self.wp_idx += reached & ~last
+        self.done |= reached & last
+        self.is_end = bool(self.done.all())
+
+    def target_zone(self):
+        ''' Discs whose entry triggers the next waypoint switches, None once
+            all the paths are complete
+
+            Detail:
+              The centers of the carts which completed their path are nan,
+              so that CartFleet.time_to_zone ignores them
+        '''
+        if self.is_end:
+            return None
+        centers = np.where(self.done[:,None], np.nan, self.current_wp)
+        return (centers, self.wp_tol)
+
+    def LOS(self, p, wp):
+        ''' Guidance law to generate the heading references
+        '''
+        th_ref = arctan2(wp[:,1]-p[:,1], wp[:,0]-p[:,0])
+        th_err = normalize(th_ref-p[:,2])
+
+        return th_err
+
+    def P(self, K, err):
+        ''' P controller to generate the angular speed commands
+        '''
+        return K*err
+
+    def transform(self, v, w):
+        ''' Transform linear and angular speeds into wheel angular speeds
+        '''
+        u = np.empty((self.n, 2))
+        u[:,0] = (2*v + self.L*w) / (2*self.r)
+        u[:,1] = (2*v - self.L*w) / (2*self.r)
+
+        return u
@@ -0,0 +1,241 @@
+'''
+Fused kernel for the closed loop controller and cart step
+
+One step of ClosedLoopCtrl (supervisor, LOS guidance, P control, transform
+to wheel speeds) followed by the exact integration of the Cart motion is
+expressed as plain arithmetic on flat arrays, for a batch of carts. Whole
+rollouts of thousands of steps then run in a single call.
+
+If Numba is installed, the kernel is compiled to a scalar loop. Otherwise
+small batches run the same loop on Python floats, which avoids the call
+overhead of NumPy on tiny arrays, and larger batches a NumPy version
+vectorized over the carts, which only returns to the interpreter once per
+step.
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+from telemetry import FINAL_TARGET
+import math
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+# Batch size from which the NumPy version is used without Numba
+NUMPY_MIN_BATCH = 64
+
+def rollout_loop(p, path, wp_idx, done, K, v, wp_tol, L, r, dt, n_steps,
+                 out):
+    ''' Scalar implementation of rollout(), compiled when Numba is available
+    '''
+    n = p.shape[0]
+    n_wp = path.shape[0]
+    two_pi = 2*math.pi
+
+    for k in range(n_steps):
+        n_done = 0
+        for j in range(n):
+            if done[j]:
+                n_done += 1
+                continue
+
+            x = p[j, 0]
+            y = p[j, 1]
+            th = p[j, 2]
+
+            # Supervisor
+            wx = path[wp_idx[j]-1, 0]
+            wy = path[wp_idx[j]-1, 1]
+            if math.sqrt((x-wx)**2 + (y-wy)**2)<wp_tol:
+                if wp_idx[j]<n_wp:
+                    wp_idx[j] += 1
+                    wx = path[wp_idx[j]-1, 0]
+                    wy = path[wp_idx[j]-1, 1]
+                else:
+                    done[j] = True # Zero command for the last step
+                    n_done += 1
+                    continue
+
+            # LOS guidance, P control and wheel speeds
+            th_err = math.atan2(wy-y, wx-x) - th
+            th_err = math.pi - (math.pi - th_err)%two_pi
+            w = K*th_err
+            u0 = (2*v + L*w) / (2*r)
+            u1 = (2*v - L*w) / (2*r)
+
+            # Exact integration
+            v_c = r/2 * (u0 + u1)
+            w_c = r*(u0 - u1)/L
+            dth = w_c*dt
+            if abs(dth)<1e-6:
+                th_mid = th + dth/2
+                x += v_c*dt*math.cos(th_mid)
+                y += v_c*dt*math.sin(th_mid)
+            else:
+                x += v_c/w_c*(math.sin(th+dth) - math.sin(th))
+                y -= v_c/w_c*(math.cos(th+dth) - math.cos(th))
+
+            p[j, 0] = x
+            p[j, 1] = y
+            p[j, 2] = math.pi - (math.pi - (th+dth))%two_pi
+
+        out[k+1] = p
+        if n_done==n:
+            return k+1
+
+    return n_steps
+
+def rollout_numpy(p, path, wp_idx, done, K, v, wp_tol, L, r, dt, n_steps,
+                  out):
+    ''' NumPy implementation of rollout(), vectorized over the carts
+    '''
+    n_wp = len(path)
+
+    for k in range(n_steps):
+        active = ~done
+        (x, y, th) = p.T
+
+        # Supervisor
+        wp = path[wp_idx-1]
+        reached = active & (np.hypot(x-wp[:,0], y-wp[:,1])<wp_tol)
+        switch = reached & (wp_idx<n_wp)
+        wp_idx[switch] += 1
+        done |= reached & ~switch # Zero command for the last step
+        active &= ~done
+        wp = path[wp_idx-1]
+
+        # LOS guidance, P control and wheel speeds
+        th_err = normalize(arctan2(wp[:,1]-y, wp[:,0]-x) - th)
+        w = K*th_err
+        u0 = (2*v + L*w) / (2*r)
+        u1 = (2*v - L*w) / (2*r)
+
+        # Exact integration
+        v_c = r/2 * (u0 + u1)
+        w_c = r*(u0 - u1)/L
+        dth = w_c*dt
+        straight = abs(dth)<1e-6
+        w_safe = np.where(straight, 1., w_c)
+        th_mid = th + dth/2
+        dx = np.where(straight, v_c*dt*cos(th_mid),
+                      v_c/w_safe*(sin(th+dth) - sin(th)))
+        dy = np.where(straight, v_c*dt*sin(th_mid),
+                      -v_c/w_safe*(cos(th+dth) - cos(th)))
+
+        p[:,0] += np.where(active, dx, 0.)
+        p[:,1] += np.where(active, dy, 0.)
+        p[:,2] = np.where(active, normalize(th + dth), th)
+
+        out[k+1] = p
+        if done.all():
+            return k+1
+
+    return n_steps
+
+if HAVE_NUMBA:
+    rollout_loop = njit(cache=True)(rollout_loop)
+
+def rollout(p, path, wp_idx, done, K, v, wp_tol, L, r, dt, n_steps,
+            out=None):
+    ''' Run up to n_steps closed loop control and integration steps for a
+        batch of carts
+
+        Detail:
+          Equivalent to running ClosedLoopCtrl (without lookahead) with a
+          Cart using the "exact" integrator, in a headless Simulator. The
+          state arrays are updated in place. A cart is done once it reaches
+          the final waypoint; the rollout stops early when all are done.
+
+        Inputs:
+          - p: (n, 3) states [x, y, theta]
+          - path: (m, 2) waypoints
+          - wp_idx: (n,) integer indices of the current waypoints, from 1
+          - done: (n,) booleans, carts which reached the final waypoint
+          - K, v, wp_tol: controller gain, cruise speed and waypoint
+                          tolerance
+          - L, r: cart axle length and wheel diameter
+          - dt: time step
+          - n_steps: maximal number of steps
+          - out: (n_steps+1, n, 3) buffer for the states, allocated if None
+
+        Output:
+          - n_run: number of steps run
+          - out: states before and after each step, valid up to row n_run
+    '''
+    if out is None:
+        out = np.empty((n_steps+1, len(p), 3))
+    out[0] = p
+
+    if HAVE_NUMBA or len(p)<NUMPY_MIN_BATCH:
+        impl = rollout_loop
+    else:
+        impl = rollout_numpy
+    n_run = impl(p, path, wp_idx, done, float(K), float(v),
+                 float(wp_tol), float(L), float(r), float(dt),
+                 int(n_steps), out)
+
+    return (n_run, out)
+
+def fused_run(cart, controller, dt, timeout=100., chunk=4096):
+    ''' Fused counterpart of a headless Simulator run of a ClosedLoopCtrl
+
+        Detail:
+          The states of the cart and of the controller are updated as if
+          the simulation had run. Intermediate telemetry events (new
+          targets) are not emitted, only the final one.
+
+        Inputs:
+          - cart: Cart, integrated with the exact solution
+          - controller: ClosedLoopCtrl, without lookahead
+          - dt: fixed simulation step
+          - timeout: simulated time after which the run is stopped
+          - chunk: number of steps per kernel call
+
+        Output:
+          - trajectory: array of rows [t, x, y, theta], including the
+                        initial state
+    '''
+    if controller.lookahead is not None:
+        raise ValueError("The fused kernel does not support lookahead")
+
+    p = array(cart.p, dtype="float").reshape(1, 3)
+    path = array(controller.path, dtype="float").reshape(-1, 2)
+    wp_idx = np.array([controller.wp_idx], dtype=np.int64)
+    done = np.array([controller.is_end])
+    out = np.empty((chunk+1, 1, 3))
+
+    n_max = int(timeout/dt) + 1
+    states = [p.copy()]
+    n_total = 0
+    while not done[0] and n_total<n_max:
+        (n_run, out) = rollout(p, path, wp_idx, done,
+                               controller.K, controller.v, controller.wp_tol,
+                               cart.L, cart.r, dt,
+                               min(chunk, n_max - n_total), out)
+        states.append(out[1:n_run+1,0].copy())
+        n_total += n_run
+
+    states = np.concatenate(states)
+    t = cart.t + dt*np.arange(len(states))
+
+    cart.p_prev = states[-2] if len(states)>1 else cart.p
+    cart.p = states[-1].copy()
+    cart.t = t[-1]
+    controller.t = t[-1] - dt
+    controller.wp_idx = int(wp_idx[0])
+    controller.current_wp = controller.path[controller.wp_idx-1]
+    if done[0] and not controller.is_end:
+        controller.is_end = True
+        controller.current_wp = None
+        controller.telemetry.emit(FINAL_TARGET, t=controller.t)
+
+    return np.column_stack((t, states))
@@ -20,26 +20,95 @@ def transform_pattern(M, x, y, th):
     ''' Perform the transformation on pattern M
 
         Inputs:
-          - M: base shape
+          - M: base shape, either as (2, K) points or as (3, K) points in
+               homogeneous coordinates. The latter avoids a copy
           - x,y: translation coordinates
           - th: rotation angle
     '''
-    M1 = ones((1, len(M[1,:])))
-    M2 = vstack((M, M1))
+    if len(M)==2:
+        M = vstack((M, ones((1, len(M[1,:])))))
     R = array([[cos(th), -sin(th),x],
                [sin(th), cos(th),y]])
-    return(R @ M2)
+    return(R @ M)
+
+def transform_patterns(M, poses, out=None):
+    ''' Perform the transformation on pattern M for many poses at once
+
+        Inputs:
+          - M: base shape, either as (2, K) points or as (3, K) points in
+               homogeneous coordinates
+          - poses: (N, 3) array of [x, y, th]
+          - out: optional (N, 2, K) array the outlines are written into,
+                 so that repeated calls do not allocate
+
+        Output:
+          - out: (N, 2, K) array of transformed outlines
+    '''
+    M = asarray(M, dtype="float")
+    if len(M)==2:
+        M = vstack((M, ones((1, M.shape[1]))))
+    poses = asarray(poses, dtype="float").reshape(-1, 3)
+
+    c = cos(poses[:,2])
+    s = sin(poses[:,2])
+    R = np.empty((len(poses), 2, 3))
+    R[:,0,0] = c
+    R[:,0,1] = -s
+    R[:,0,2] = poses[:,0]
+    R[:,1,0] = s
+    R[:,1,1] = c
+    R[:,1,2] = poses[:,1]
+
+    if out is None:
+        out = np.empty((len(poses), 2, M.shape[1]))
+    return np.einsum("nij,jk->nik", R, M, out=out)
 
 def normalize(angle):
-    ''' Normalize an angle in radians between -pi and pi
+    ''' Normalize angles in radians in the interval (-pi, pi]
+
+        Detail:
+          Branch-free, so that it applies element-wise to arrays as well as
+          to scalars
 
         Inputs:
-          - angle: angle to normalize
+          - angle: angle or array of angles to normalize
     '''
-    angle = angle%(2*pi)
-    if angle>pi:
-        angle -= 2*pi
-    return angle
+    return pi - (pi - angle)%(2*pi)
+
+def create_display(path=None):
+    ''' Create the figure and artists used to display a simulation
+
+        Inputs:
+          - path: list of waypoints to draw, if any
+
+        Output:
+          - fig: matplotlib figure
+          - lines: tuple of artists (true shape, estimated shape, 5 texts
+                   and, when a path is given, the waypoints scatter)
+    '''
+    fig = figure()
+    ax = fig.add_subplot(111,
+                         aspect="equal",
+                         autoscale_on=False,
+                         xlim=(-10, 10),
+                         ylim=(-7, 10))
+    ax.grid()
+
+    lines = (ax.plot([], [], color="b", lw=2)[0],
+             ax.plot([], [], color="r", lw=2)[0],
+             ax.text(0.75, 0.95, "", transform=ax.transAxes),
+             ax.text(0.02, 0.95, "", transform=ax.transAxes),
+             ax.text(0.02, 0.90, "", transform=ax.transAxes),
+             ax.text(0.02, 0.85, "", transform=ax.transAxes),
+             ax.text(0.02, 0.80, "", transform=ax.transAxes))
+
+    if path is not None and len(path)>0:
+        lines += (ax.scatter([e[0] for e in path],
+                             [e[1] for e in path],
+                             marker="o",
+                             s=[100]*len(path)),)
+
+    return fig, lines
 
 def draw_path(path, stage, sim_end=False):
     ''' Create the colormap for the path drawing
@@ -63,3 +132,25 @@ def draw_path(path, stage, sim_end=False):
         cmap[-1] = "g"
 
     return cmap
+
+def dist_to_path(points, path):
+    ''' Distance from each point to the closest segment of a polyline
+
+        Inputs:
+          - points: (T, 2) array of positions
+          - path: sequence of (x, y) waypoints defining the polyline
+    '''
+    points = asarray(points, dtype="float")
+    path = asarray(path, dtype="float")
+    if len(path)==1:
+        return np.hypot(*(points - path[0]).T)
+
+    a = path[:-1]
+    ab = path[1:] - a
+    ab2 = np.maximum((ab**2).sum(axis=1), 1e-12)
+
+    ap = points[:,None,:] - a[None,:,:]
+    s = np.clip((ap*ab).sum(axis=2)/ab2, 0., 1.)
+    d = ap - s[:,:,None]*ab[None,:,:]
+
+    return np.hypot(d[...,0], d[...,1]).min(axis=1)
@@ -12,7 +12,7 @@ license: GNU GPL
 from lib import *
 from plant import Cart
 from simulator import Simulator
-from controller import OpenLoopCtrl, ClosedLoopCtrl
+from controller import OpenLoopCtrl, ClosedLoopCtrl, PurePursuitCtrl
 
 cart = Cart(p0=[-3., 5., -pi/4])
 
@@ -40,5 +40,25 @@ path=[(0.0, 0.0),
 controller = ClosedLoopCtrl(cart,
                             reference=path)
 
+# Pure pursuit alternative
+#controller = PurePursuitCtrl(cart,
+#                             reference=path,
+#                             lookahead=1.0)
+
+# Noisy GPS with a particle filter (see sensor.py and observer.py)
+#from sensor import GPSSensor
+#from observer import ParticleObs
+#cart.sensors = [GPSSensor(sigma=0.2, rate=5., seed=0)]
+#observer = ParticleObs(cart, n=2000, R=(0.2, 0.2), seed=0)
+#Simulator(cart,
+#          controller=controller,
+#          observer=observer)
+
 Simulator(cart,
           controller=controller)
+
+#--------------------------------------------------------------------------
+# Headless run with a fixed time step (no display)
+#trajectory = Simulator(cart,
+#                       controller=controller,
+#                       headless=True).run(dt=0.01)
@@ -0,0 +1,255 @@
+'''
+Monte-Carlo robustness study of the closed loop controller
+
+Seeded headless episodes are run with randomized initial poses and noisy
+pose sensors. The episodes are fanned out over a process pool in batches,
+and each worker writes the metrics of its episodes straight into a table
+held in shared memory, so that no result is pickled back. Confidence
+intervals on the success rate and on the final error are updated each time
+a batch completes, and the run stops early once they are tight enough.
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+from plant import Cart
+from sensor import GaussianPoseSensor
+from observer import EKFObs
+from simulator import Simulator
+from controller import ClosedLoopCtrl
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import os
+
+# Columns of the result table
+MC_DTYPE = [("seed", "i8"),
+            ("x0", "f8"),
+            ("y0", "f8"),
+            ("th0", "f8"),
+            ("success", "i8"),
+            ("t_finish", "f8"),
+            ("final_err", "f8"),
+            ("path_err_mean", "f8"),
+            ("done", "i8")]
+
+Z_95 = 1.959964 # Two-sided 95% quantile of the normal distribution
+
+# Shared result table, attached once per worker process
+_shm = None
+_table = None
+_config = None
+
+def _attach(name, n, config):
+    ''' Worker initializer: attach the shared result table
+    '''
+    global _shm, _table, _config
+    _shm = shared_memory.SharedMemory(name=name)
+    _table = np.ndarray(n, dtype=MC_DTYPE, buffer=_shm.buf)
+    _config = config
+
+def run_episode(i, seed, config):
+    ''' Run one seeded headless episode
+
+        Inputs:
+          - i: index of the episode
+          - seed: seed of the whole study
+          - config: dictionnary with keys p0, spread, sigma, path, K, v,
+                    wp_tol, L, r, dt, timeout and ekf, see montecarlo()
+
+        Output:
+          - metrics: tuple (x0, y0, th0, success, t_finish, final_err,
+                     path_err_mean)
+    '''
+    rng = np.random.default_rng([seed, i])
+    p0 = (asarray(config["p0"], dtype="float")
+          + asarray(config["spread"])*rng.uniform(-1., 1., 3))
+    sensor = GaussianPoseSensor(sigma=config["sigma"],
+                                seed=rng.integers(2**63))
+
+    cart = Cart(p0=p0,
+                L=config["L"],
+                r=config["r"],
+                integrator="exact",
+                sensors=[sensor])
+    controller = ClosedLoopCtrl(cart,
+                                reference=config["path"],
+                                K=config["K"],
+                                v=config["v"],
+                                wp_tol=config["wp_tol"])
+    observer = None
+    if config["ekf"]:
+        observer = EKFObs(cart, R=config["sigma"])
+
+    sim = Simulator(cart,
+                    controller=controller,
+                    observer=observer,
+                    sim_timeout=config["timeout"],
+                    headless=True)
+    sim.run(config["dt"])
+
+    success = controller.is_end
+    t_finish = sim.sim_t if success else np.nan
+    final_err = np.hypot(*(cart.p[:2] - asarray(config["path"][-1])))
+    path_err = dist_to_path(sim.recorder["p"][:,:2], config["path"]).mean()
+
+    return (p0[0], p0[1], p0[2], success, t_finish, final_err, path_err)
+
+def _run_batch(indices, seed):
+    ''' Worker task: run the episodes of a batch into the shared table
+    '''
+    for i in indices:
+        row = _table[i:i+1]
+        row[["x0", "y0", "th0", "success", "t_finish", "final_err",
+             "path_err_mean"]] = run_episode(i, seed, _config)
+        row["seed"] = seed
+        row["done"] = 1 # Written last, marks the row as complete
+    return len(indices)
+
+def confidence(table):
+    ''' 95% confidence intervals over the completed episodes
+
+        Detail:
+          Wilson score interval for the success rate, normal interval for
+          the mean final error
+
+        Inputs:
+          - table: result table, see MC_DTYPE
+
+        Output:
+          - ci: dictionnary with keys n, success and final_err, the last
+                two being (estimate, lower bound, upper bound)
+    '''
+    rows = table[table["done"]==1]
+    n = len(rows)
+    if n==0:
+        return {"n": 0,
+                "success": (np.nan, 0., 1.),
+                "final_err": (np.nan, -np.inf, np.inf)}
+
+    rate = rows["success"].mean()
+    z2 = Z_95**2
+    center = (rate + z2/(2*n))/(1 + z2/n)
+    half = Z_95*sqrt(rate*(1 - rate)/n + z2/(4*n**2))/(1 + z2/n)
+
+    err = rows["final_err"]
+    err_mean = err.mean()
+    err_half = Z_95*err.std(ddof=1)/sqrt(n) if n>1 else np.inf
+
+    return {"n": n,
+            "success": (rate, center - half, center + half),
+            "final_err": (err_mean, err_mean - err_half, err_mean + err_half)}
+
+def format_confidence(ci):
+    ''' One line summary of confidence intervals
+    '''
+    return ("n={:6d}  success {:.3f} [{:.3f}, {:.3f}]  "
+            "final error {:.4f} [{:.4f}, {:.4f}]").format(
+                ci["n"], *ci["success"], *ci["final_err"])
+
+def montecarlo(n_episodes=1000,
+               seed=0,
+               p0=[-3., 5., -pi/4],
+               spread=[1., 1., pi/8],
+               sigma=[0.05, 0.05, 0.02],
+               path=[(0.0, 0.0), (4.0, 0.0), (3.0, -3.0), (-2.0, 0.0)],
+               K=2.,
+               v=2.,
+               wp_tol=0.2,
+               L=1.,
+               r=1.,
+               dt=0.05,
+               timeout=100.,
+               ekf=False,
+               batch=None,
+               min_episodes=100,
+               success_tol=0.02,
+               err_tol=None,
+               max_workers=None,
+               verbose=True):
+    ''' Run seeded episodes in parallel until the confidence intervals are
+        tight enough or n_episodes have been run
+
+        Inputs:
+          - n_episodes: maximal number of episodes
+          - seed: seed of the study. Episode i only depends on (seed, i)
+          - p0: nominal initial state [x, y, theta]
+          - spread: half-widths of the uniform perturbation of p0
+          - sigma: standard deviations of the pose sensor noise
+          - path: list of (x, y) waypoints
+          - K, v, wp_tol: controller gain, cruise speed and waypoint
+                          tolerance
+          - L, r: cart axle length and wheel diameter
+          - dt: fixed simulation step
+          - timeout: simulated time after which an episode fails
+          - ekf: if True, the noisy readings are filtered by an EKFObs,
+                 otherwise the controller uses them directly
+          - batch: number of episodes per task, defaults to a few tasks per
+                   worker and per min_episodes
+          - min_episodes: number of episodes before early stopping is
+                          considered
+          - success_tol: target half-width of the success rate interval
+          - err_tol: target half-width of the final error interval, None to
+                     ignore it
+          - max_workers: number of processes, defaults to all the cores
+          - verbose: print the confidence intervals after each batch
+
+        Output:
+          - table: structured array with one row per completed episode, see
+                   MC_DTYPE
+          - ci: final confidence intervals, see confidence()
+    '''
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    if batch is None:
+        batch = max(1, min(min_episodes, n_episodes)//(2*max_workers))
+
+    config = {"p0": p0, "spread": spread, "sigma": sigma, "path": path,
+              "K": K, "v": v, "wp_tol": wp_tol, "L": L, "r": r,
+              "dt": dt, "timeout": timeout, "ekf": ekf}
+
+    itemsize = np.dtype(MC_DTYPE).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=n_episodes*itemsize)
+    try:
+        table = np.ndarray(n_episodes, dtype=MC_DTYPE, buffer=shm.buf)
+        table["done"] = 0
+
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_attach,
+                                 initargs=(shm.name, n_episodes, config)
+                                 ) as pool:
+            tasks = [pool.submit(_run_batch, range(i, min(i+batch,
+                                                          n_episodes)), seed)
+                     for i in range(0, n_episodes, batch)]
+
+            for task in as_completed(tasks):
+                task.result()
+                ci = confidence(table)
+                if verbose:
+                    print(format_confidence(ci))
+
+                tight = (ci["success"][2] - ci["success"][1])/2<=success_tol
+                if err_tol is not None:
+                    tight &= ((ci["final_err"][2] - ci["final_err"][1])/2
+                              <=err_tol)
+                if ci["n"]>=min_episodes and tight:
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    break
+
+        table = table[table["done"]==1].copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return (table, confidence(table))
+
+
+if __name__=="__main__":
+    (table, ci) = montecarlo(n_episodes=2000,
+                             success_tol=0.02,
+                             err_tol=0.005)
+    print("Final:", format_confidence(ci))
@@ -24,16 +24,14 @@ class IdealObs:
         self.cart = cart
         self.p = cart.p
         self.L = cart.L
-        self.base_shape = cart.base_shape
-        self.shape = self.base_shape
+        self.hom_shape = cart.hom_shape
 
-    def update_shape(self):
-        ''' Update the drawing of the cart
+    @property
+    def shape(self):
+        ''' Drawing of the cart at the estimated state, computed on request
         '''
-        p = self.p.flatten()
-        M = self.L*array(self.base_shape)
-        M = transform_pattern(M, p[0], p[1], p[2])
-        self.shape = M
+        p = self.p
+        return transform_pattern(self.hom_shape, p[0], p[1], p[2])
 
     def update_est(self, sensor_readings, dt):
         ''' Provide the new estimate of the system state
@@ -44,4 +42,190 @@ class IdealObs:
         '''
         self.p = sensor_readings[0]
 
-        self.update_shape()
+
+class FilterObs(IdealObs):
+    ''' Base class of the filtering observers
+
+        Detail:
+          The prediction uses the wheel speeds last applied to the cart
+          (cart.u), the correction uses the readings of one of the cart's
+          sensors. A reading of 3 values is taken as a full pose (x, y,
+          theta), a reading of 2 values as a position (x, y). Held readings
+          are only used once, missing readings (None) are skipped.
+
+        Inputs:
+          - cart: observed cart
+          - sensor: index of the sensor used for the correction
+          - R: standard deviations of the measurement noise, on (x, y,
+               theta)
+          - sigma_u: standard deviation of the wheel speed noise
+    '''
+    def __init__(self, cart, sensor=0, R=(0.05, 0.05, 0.02), sigma_u=0.05):
+        IdealObs.__init__(self, cart)
+        self.p = array(cart.p, dtype="float")
+        self.sensor = sensor
+        self.R = asarray(R, dtype="float")
+        self.sigma_u = sigma_u
+        self.last_reading = None
+
+    def new_reading(self, sensor_readings):
+        ''' Reading of the correction sensor if it is new, else None
+        '''
+        z = sensor_readings[self.sensor]
+        if z is None or z is self.last_reading:
+            return None
+        self.last_reading = z
+        return asarray(z, dtype="float")
+
+    def update_est(self, sensor_readings, dt):
+        ''' Provide the new estimate of the system state
+
+            Inputs:
+              - sensor_readings: current sensor readings
+              - dt: time passed since last estimation
+        '''
+        if self.cart.u is not None and dt>0:
+            self.predict(asarray(self.cart.u, dtype="float"), dt)
+
+        z = self.new_reading(sensor_readings)
+        if z is not None:
+            self.correct(z)
+
+
+class EKFObs(FilterObs):
+    ''' Extended Kalman filter observer
+
+        Detail:
+          The state is propagated with the cart kinematics (dp_dt, one
+          Euler step), and the covariance through their Jacobian. The
+          wheel speed noise is mapped to the state through the Jacobian with
+          respect to the inputs.
+
+        Inputs:
+          - cart: observed cart
+          - sensor: index of the sensor used for the correction
+          - R: standard deviations of the measurement noise, on (x, y,
+               theta)
+          - sigma_u: standard deviation of the wheel speed noise
+          - sigma0: standard deviations of the initial estimate
+    '''
+    def __init__(self, cart, sensor=0, R=(0.05, 0.05, 0.02), sigma_u=0.05,
+                 sigma0=(0.01, 0.01, 0.01)):
+        FilterObs.__init__(self, cart, sensor, R, sigma_u)
+        self.P = np.diag(asarray(sigma0, dtype="float")**2)
+
+    def predict(self, u, dt):
+        cart = self.cart
+        p = self.p
+        v = cart.r/2 * (u[0] + u[1])
+        (c, s) = (cos(p[2]), sin(p[2]))
+
+        F = np.eye(3)
+        F[0, 2] = -v*s*dt
+        F[1, 2] = v*c*dt
+
+        # Jacobian of the state increment with respect to (u0, u1)
+        G = dt*array([[cart.r/2*c, cart.r/2*c],
+                      [cart.r/2*s, cart.r/2*s],
+                      [cart.r/cart.L, -cart.r/cart.L]])
+
+        self.p = p + cart.dp_dt(p, 0., u[0], u[1])*dt
+        self.p[2] = normalize(self.p[2])
+        self.P = F @ self.P @ F.T + self.sigma_u**2 * (G @ G.T)
+
+    def correct(self, z):
+        m = len(z)
+        H = np.eye(3)[:m]
+        y = z - self.p[:m]
+        if m==3:
+            y[2] = normalize(y[2])
+
+        S = H @ self.P @ H.T + np.diag(self.R[:m]**2)
+        K = np.linalg.solve(S, H @ self.P).T
+
+        self.p = self.p + K @ y
+        self.p[2] = normalize(self.p[2])
+        self.P = (np.eye(3) - K @ H) @ self.P
+
+
+class ParticleObs(FilterObs):
+    ''' Particle filter observer
+
+        Detail:
+          The particles are stored as a (3, n) array, so that the whole set
+          is propagated by a single call to the cart kinematics (dp_dt),
+          each particle with its own noisy wheel speeds. Particles are
+          resampled systematically when the effective sample size drops
+          below n/2. The estimate is the weighted mean of the particles,
+          with the circular mean for the heading.
+
+        Inputs:
+          - cart: observed cart
+          - n: number of particles
+          - sensor: index of the sensor used for the correction
+          - R: standard deviations of the measurement noise, on (x, y,
+               theta)
+          - sigma_u: standard deviation of the wheel speed noise
+          - sigma0: standard deviations of the initial particle spread
+          - seed: seed of the random generator
+    '''
+    def __init__(self, cart, n=2000, sensor=0, R=(0.05, 0.05, 0.02),
+                 sigma_u=0.05, sigma0=(0.01, 0.01, 0.01), seed=None):
+        FilterObs.__init__(self, cart, sensor, R, sigma_u)
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+
+        sigma0 = asarray(sigma0, dtype="float")[:, None]
+        self.particles = (self.p[:, None]
+                          + sigma0*self.rng.standard_normal((3, n)))
+        self.weights = np.full(n, 1./n)
+
+    def predict(self, u, dt):
+        noise = self.sigma_u*self.rng.standard_normal((2, self.n))
+        u0 = u[0] + noise[0]
+        u1 = u[1] + noise[1]
+
+        particles = self.particles
+        particles += self.cart.dp_dt(particles, 0., u0, u1)*dt
+        particles[2] = normalize(particles[2])
+
+        self.estimate()
+
+    def correct(self, z):
+        m = len(z)
+        y = z[:, None] - self.particles[:m]
+        if m==3:
+            y[2] = normalize(y[2])
+
+        log_w = -0.5*np.sum((y/self.R[:m, None])**2, axis=0)
+        w = self.weights*np.exp(log_w - log_w.max())
+        total = w.sum()
+        if total>0:
+            self.weights = w/total
+        else: # All particles are inconsistent with the reading
+            self.weights = np.full(self.n, 1./self.n)
+
+        if 1./np.sum(self.weights**2)<self.n/2:
+            self.resample()
+
+        self.estimate()
+
+    def resample(self):
+        ''' Systematic resampling of the particles
+        '''
+        positions = (self.rng.random() + np.arange(self.n))/self.n
+        cumulative = np.cumsum(self.weights)
+        cumulative[-1] = 1.
+        idx = np.searchsorted(cumulative, positions)
+
+        self.particles = self.particles[:, idx]
+        self.weights = np.full(self.n, 1./self.n)
+
+    def estimate(self):
+        ''' Weighted mean of the particles
+        '''
+        (x, y, th) = self.particles
+        w = self.weights
+        self.p = array([np.dot(w, x),
+                        np.dot(w, y),
+                        arctan2(np.dot(w, sin(th)), np.dot(w, cos(th)))])
@@ -0,0 +1,227 @@
+'''
+Spatial index over the segments of a path
+
+The index is built once per path. Closest point queries are answered by an
+incremental search from the last matched segment, falling back to a KD-tree
+search over the segments when there is no previous match.
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+from scipy.spatial import cKDTree
+from math import hypot
+
+class PathIndex:
+    ''' Index of the segments of a polyline path
+
+        Detail:
+          The segment midpoints are stored in a KD-tree. A global query
+          only projects the point on the segments whose midpoint is close
+          enough to possibly hold the closest point.
+
+          Incremental queries start from a hint, the segment matched at the
+          previous step, and move forward (or backward) along the path while
+          the distance decreases. As a vehicle progresses along the path,
+          each query then visits a bounded number of segments. It also keeps
+          the match on the current branch where the path crosses itself.
+
+        Inputs:
+          - path: sequence of (x, y) waypoints, at least 2
+          - patience: number of segments examined past the best match
+                      during an incremental search, to step over local
+                      bumps of the distance
+    '''
+    def __init__(self, path, patience=4):
+        self.points = asarray(path, dtype="float")
+        if len(self.points)<2:
+            raise ValueError("A path index needs at least 2 waypoints")
+
+        self.a = self.points[:-1]
+        self.ab = self.points[1:] - self.a
+        self.seg_len = np.hypot(self.ab[:,0], self.ab[:,1])
+        self.n_seg = len(self.a)
+
+        # Arc length at each waypoint
+        self.s = np.concatenate(([0.], np.cumsum(self.seg_len)))
+
+        # Unit vectors and headings of the segments
+        self.unit = self.ab/np.maximum(self.seg_len, 1e-12)[:,None]
+        self.heading = arctan2(self.ab[:,1], self.ab[:,0])
+
+        self.patience = patience
+
+        self.tree = cKDTree(self.a + self.ab/2)
+        self.half_len = self.seg_len.max()/2
+
+    def project(self, q, i):
+        ''' Closest point of segment i to point q
+
+            Output:
+              - dist: distance from q to the segment
+              - t: position of the closest point on the segment, in [0, 1]
+        '''
+        (ax, ay) = self.a[i]
+        (bx, by) = self.ab[i]
+        l2 = bx*bx + by*by
+        t = 0. if l2==0. else ((q[0]-ax)*bx + (q[1]-ay)*by)/l2
+        t = min(max(t, 0.), 1.)
+
+        return hypot(ax + t*bx - q[0], ay + t*by - q[1]), t
+
+    def nearest_global(self, q):
+        ''' Closest segment to point q, searched with the KD-tree
+
+            Output:
+              - i: index of the closest segment
+              - t: position of the closest point on the segment
+              - dist: distance from q to the segment
+        '''
+        # The segment of the closest midpoint is at most d away, and any
+        # segment as close as that has its midpoint within d + half_len
+        (d, i) = self.tree.query(q)
+        candidates = self.tree.query_ball_point(q, d + self.half_len)
+
+        best = (i, 0., np.inf)
+        for i in candidates:
+            (d, t) = self.project(q, i)
+            if d<best[2]:
+                best = (i, t, d)
+
+        return best
+
+    def nearest(self, q, hint=None):
+        ''' Closest segment to point q
+
+            Inputs:
+              - q: query point (x, y)
+              - hint: index of the segment matched at the previous query.
+                      If None, a global search is performed
+
+            Output:
+              - i: index of the closest segment
+              - t: position of the closest point on the segment
+              - dist: distance from q to the segment
+        '''
+        if hint is None:
+            return self.nearest_global(q)
+
+        (d, t) = self.project(q, hint)
+        best = (hint, t, d)
+        for direction in [1, -1]:
+            i = hint
+            misses = 0
+            while misses<self.patience:
+                i += direction
+                if i<0 or i>=self.n_seg:
+                    break
+                (d, t) = self.project(q, i)
+                if d<best[2]:
+                    best = (i, t, d)
+                    misses = 0
+                else:
+                    misses += 1
+            if best[0]!=hint:
+                break
+
+        return best
+
+    def advance(self, q, i):
+        ''' Closest point to q, moving forward from segment i
+
+            Detail:
+              The match moves to the next segment once q projects past the
+              end of the current one, or is closer to the next segment, as
+              when cutting a corner. Progress along the path is therefore
+              monotonic and no part of the path is skipped, even when a
+              later segment is closer to q
+
+            Inputs:
+              - q: query point (x, y)
+              - i: index of the segment matched at the previous query
+
+            Output:
+              - i: index of the matched segment
+              - t: position of the closest point on the segment
+              - dist: distance from q to the segment
+        '''
+        (d, t) = self.project(q, i)
+        while i<self.n_seg-1:
+            (d_next, t_next) = self.project(q, i+1)
+            if t<1. and d_next>=d:
+                break
+            (i, d, t) = (i+1, d_next, t_next)
+
+        return (i, t, d)
+
+    def arc_length(self, i, t):
+        ''' Arc length of the point at position t of segment i
+        '''
+        return self.s[i] + t*self.seg_len[i]
+
+    def point(self, i, t):
+        ''' Coordinates of the point at position t of segment i
+        '''
+        return self.a[i] + t*self.ab[i]
+
+    def point_at(self, s):
+        ''' Coordinates of the point at arc length s, found by binary search
+            on the arc length of the waypoints
+
+            Output:
+              - point: (x, y) coordinates, clipped to the ends of the path
+              - i: index of the segment holding the point
+        '''
+        s = min(max(s, 0.), self.s[-1])
+        i = min(np.searchsorted(self.s, s, side="right") - 1, self.n_seg-1)
+
+        return self.a[i] + (s - self.s[i])*self.unit[i], i
+
+    def lookahead(self, q, i, t, dist):
+        ''' First point of the path, past the closest point (i, t), at
+            distance dist from q
+
+            Detail:
+              The segments are walked forward from the closest point until
+              one ends outside of the circle of radius dist around q, then
+              the intersection is solved on that segment. If q is farther
+              than dist from the path, the point at arc length dist past the
+              closest point is returned instead. The end of the path is
+              returned when it lies within the circle.
+
+            Output:
+              - i: index of the segment holding the lookahead point
+              - t: position of the lookahead point on the segment
+        '''
+        d2 = dist*dist
+        if self.project(q, i)[0]>=dist:
+            s = min(self.arc_length(i, t) + dist, self.s[-1])
+            (point, i) = self.point_at(s)
+            return i, (s - self.s[i])/max(self.seg_len[i], 1e-12)
+
+        t_lo = t
+        while True:
+            (bx, by) = self.points[i+1] - q
+            if bx*bx + by*by>=d2:
+                break
+            if i==self.n_seg-1:
+                return i, 1.
+            i += 1
+            t_lo = 0.
+
+        # Largest root of |a + t*ab - q| = dist on segment i
+        (ax, ay) = self.a[i] - q
+        (ux, uy) = self.ab[i]
+        A = ux*ux + uy*uy
+        B = ax*ux + ay*uy
+        C = ax*ax + ay*ay - d2
+        if A==0.:
+            return i, 1.
+        t = (-B + sqrt(max(B*B - A*C, 0.)))/A
+
+        return i, min(max(t, t_lo), 1.)
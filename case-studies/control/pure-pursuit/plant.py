@@ -11,6 +11,7 @@ license: GNU GPL
 
 from lib import *
 from sensor import PerfectSensor
+from scipy.optimize import brentq
 
 class Cart:
     ''' Cart class
@@ -21,40 +22,57 @@ class Cart:
              * theta: angular position in radians
           - L: axle length
           - r: wheel diameter
+          - integrator: state integration method, among
+             * "odeint": numerical integration of dp_dt
+             * "exact": closed-form solution for constant wheel speeds
+          - sensors: list of sensors, see sensor.py. Defaults to a
+                     PerfectSensor
     '''
     def __init__(self,
                  p0=[0., 0., 0.],
                  L=1.0,
-                 r=1.0):
+                 r=1.0,
+                 integrator="odeint",
+                 sensors=None):
         self.p = asarray(p0, dtype="float")
         self.prev = asarray(p0, dtype="float")
 
         # Sensors
-        self.sensors = [PerfectSensor()]
+        self.sensors = sensors if sensors is not None else [PerfectSensor()]
+        self.readings = [None for sensor in self.sensors]
+        self.t = 0. # Time elapsed since the start of the simulation
+        self.u = None # Last applied control inputs
+        self.dt = 0. # Duration of the last step
 
         # Cart parameters
         self.L = L
         self.r = r
 
+        if integrator not in ["odeint", "exact"]:
+            raise ValueError("Unknown integrator: {}".format(integrator))
+        self.integrator = integrator
+
         self.prev_x = 0.
         self.prev_t = 0.
         self.base_shape = [[0.25,-0.25,0,0,-0.25,-0.25,0,0,-0.25,0.25,
                                                             0,0,0.85,0.85,0],
                            [-0.5,-0.5,-0.5,-0.25,-0.25,0.25,0.25,0.5,0.5,
                                             0.5,0.5,0.25,0.125,-0.125,-0.25]]
-        self.shape = self.base_shape
 
-    def update_shape(self):
-        ''' Update the drawing of the cart
+        # Scaled base shape in homogeneous coordinates, computed once
+        M = self.L*array(self.base_shape)
+        self.hom_shape = vstack((M, ones((1, M.shape[1]))))
 
-            Inputs:
-              - state x = [x, y, heading]
-              - scale factor r
+    @property
+    def shape(self):
+        ''' Drawing of the cart at the current state
+
+            Detail:
+              Only computed when requested, e.g. by a renderer, so that the
+              integration loop does not pay for it
         '''
-        p = self.p.flatten()
-        M = self.L*array(self.base_shape)
-        M = transform_pattern(M, p[0], p[1], p[2])
-        self.shape = M
+        p = self.p
+        return transform_pattern(self.hom_shape, p[0], p[1], p[2])
 
     def dp_dt(self, p, t, u0, u1):
         ''' Derivative of the state
@@ -74,6 +92,74 @@ class Cart:
 
         return dpdt
 
+    def exact_step(self, p, u, dt):
+        ''' Closed-form state after applying constant wheel speeds for dt
+
+            Detail:
+              With constant wheel speeds the cart follows a circular arc of
+              radius v/w, or a straight line when w is zero. For small w*dt
+              the straight line is taken along the mid-step heading, which
+              keeps the solution continuous and second order accurate.
+
+            Inputs:
+              - p: state of the cart
+              - u: right and left wheel angular speeds
+              - dt: duration u is applied
+        '''
+        v = self.r/2 * (u[0] + u[1])
+        w = self.r*(u[0] - u[1])/self.L
+
+        x, y, th = p
+        dth = w*dt
+        if abs(dth)<1e-6:
+            th_mid = th + dth/2
+            x += v*dt*cos(th_mid)
+            y += v*dt*sin(th_mid)
+        else:
+            x += v/w*(sin(th+dth) - sin(th))
+            y -= v/w*(cos(th+dth) - cos(th))
+
+        return array([x, y, th+dth])
+
+    def time_to_zone(self, u, center, radius, dt, n_samples=8):
+        ''' First time within dt at which the cart enters a disc, when
+            applying constant wheel speeds u
+
+            Detail:
+              The distance to the disc is sampled along the analytic
+              trajectory and the first sign change is refined with Brent's
+              method. The returned time is just past the crossing, so that
+              the cart is inside the disc at the end of a step of that length.
+              Crossings in and out between two samples are not detected.
+
+            Inputs:
+              - u: right and left wheel angular speeds
+              - center: (x, y) center of the disc
+              - radius: radius of the disc
+              - dt: time horizon
+              - n_samples: number of intervals sampled over dt
+
+            Output:
+              - tau: time of entry in the disc, None if the cart is already
+                     inside or does not enter it within dt
+        '''
+        def f(tau):
+            (x, y, th) = self.exact_step(self.p, u, tau)
+            return (x-center[0])**2 + (y-center[1])**2 - radius**2
+
+        if f(0.)<=0 or dt<=0:
+            return None
+
+        t_a = 0.
+        for k in range(1, n_samples+1):
+            t_b = dt*k/n_samples
+            if f(t_b)<=0:
+                tau = brentq(f, t_a, t_b, xtol=1e-12)
+                return min(tau + 1e-9, t_b)
+            t_a = t_b
+
+        return None
+
     def step(self, u, dt):
         ''' Execute one time step of length dt and update state
 
@@ -82,16 +168,188 @@ class Cart:
               - dt: duration u is applied
         '''
         self.p_prev = self.p
+        self.u = u
+        self.dt = dt
+        self.t += dt
 
-        self.p = odeint(self.dp_dt, self.p, [0, dt], args=u)[1]
+        if self.integrator=="exact":
+            self.p = self.exact_step(self.p, u, dt)
+        else:
+            self.p = odeint(self.dp_dt, self.p, [0, dt], args=u)[1]
         self.p[2] = normalize(self.p[2])
 
-        self.update_shape()
-
     def sense(self):
         ''' Gather current readings from the model's sensors
+
+            Detail:
+              The list of readings is reused between calls, and resized
+              when the list of sensors changes
+        '''
+        if len(self.readings)!=len(self.sensors): # Sensors were replaced
+            self.readings = [None for sensor in self.sensors]
+
+        for (i, sensor) in enumerate(self.sensors):
+            sensor.update_readings(self.p, self.t, self.u, self.dt)
+            self.readings[i] = sensor.current_readings
+
+        return self.readings
+
+
+class CartFleet:
+    ''' CartFleet class
+
+        Detail:
+          Fleet of identical carts whose states are stored in a single
+          (N, 3) array and advanced with one vectorized kinematics update
+
+        Inputs:
+          - p0: initial states, sequence of N states [x, y, theta]
+          - L: axle length
+          - r: wheel diameter
+          - sensors: list of sensors, see sensor.py. Defaults to a
+                     PerfectSensor
+    '''
+    def __init__(self,
+                 p0=[[0., 0., 0.]],
+                 L=1.0,
+                 r=1.0,
+                 sensors=None):
+        self.p = array(p0, dtype="float").reshape(-1, 3)
+        self.p_prev = self.p
+        self.n = len(self.p)
+
+        # Sensors
+        self.sensors = sensors if sensors is not None else [PerfectSensor()]
+        self.readings = [None for sensor in self.sensors]
+        self.t = 0.
+        self.u = None
+        self.dt = 0.
+
+        # Cart parameters
+        self.L = L
+        self.r = r
+
+        cart = Cart(L=L, r=r)
+        self.base_shape = cart.base_shape
+        self.hom_shape = cart.hom_shape
+        self.shape_buffer = None
+
+    @property
+    def shape(self):
+        ''' Drawings of all the carts at the current states
+
+            Detail:
+              (N, 2, K) array computed on request in one batched transform.
+              The array is reused between calls
+        '''
+        self.shape_buffer = transform_patterns(self.hom_shape, self.p,
+                                               out=self.shape_buffer)
+        return self.shape_buffer
+
+    def step(self, u, dt):
+        ''' Execute one time step of length dt for all the carts
+
+            Detail:
+              The wheel speeds are assumed constant over the step and the
+              exact arc solution is used. The chord of the arc has length
+              v*dt*sinc(w*dt/2) and is oriented along the mid-step heading,
+              which also covers the straight line case w = 0.
+
+            Inputs:
+              - u: (N, 2) array of right and left wheel angular speeds
+              - dt: duration u is applied
         '''
-        for sensor in self.sensors:
-            sensor.update_readings(self.p)
+        u = asarray(u, dtype="float")
+        self.p_prev = self.p
+        self.u = u
+        self.dt = dt
+        self.t += dt
+
+        self.p = self.exact_step(self.p, u, dt)
+        self.p[:,2] = normalize(self.p[:,2])
+
+    def exact_step(self, p, u, dt):
+        ''' Closed-form states after applying constant wheel speeds for dt
+
+            Inputs:
+              - p: (N, 3) states of the carts
+              - u: (N, 2) array of right and left wheel angular speeds
+              - dt: duration u is applied, scalar or (N,) array
+
+            Output:
+              - p: (N, 3) new states, headings not normalized
+        '''
+        v = self.r/2 * (u[:,0] + u[:,1])
+        w = self.r*(u[:,0] - u[:,1])/self.L
+
+        dth = w*dt
+        th_mid = p[:,2] + dth/2
+        chord = v*dt*np.sinc(dth/(2*pi))
+
+        p_new = np.empty_like(p)
+        p_new[:,0] = p[:,0] + chord*cos(th_mid)
+        p_new[:,1] = p[:,1] + chord*sin(th_mid)
+        p_new[:,2] = p[:,2] + dth
+        return p_new
+
+    def time_to_zone(self, u, center, radius, dt, n_samples=8):
+        ''' First time within dt at which any cart enters its disc, when
+            applying constant wheel speeds u
+
+            Detail:
+              Same method as Cart.time_to_zone, with the distances of all
+              the carts sampled in one batch. Only the carts crossing in the
+              first sampled interval holding a crossing are refined with
+              Brent's method. Carts already inside their disc, or whose
+              center is nan (e.g. carts which completed their path), are
+              ignored.
+
+            Inputs:
+              - u: (N, 2) array of right and left wheel angular speeds
+              - center: (N, 2) centers of the discs
+              - radius: radius of the discs
+              - dt: time horizon
+              - n_samples: number of intervals sampled over dt
+
+            Output:
+              - tau: earliest time of entry in a disc, None if no cart
+                     enters its disc within dt
+        '''
+        u = asarray(u, dtype="float")
+        center = asarray(center, dtype="float")
+        if dt<=0:
+            return None
+
+        def f(tau, idx=slice(None)):
+            p = self.exact_step(self.p[idx], u[idx], tau)
+            return ((p[:,0]-center[idx,0])**2 + (p[:,1]-center[idx,1])**2
+                    - radius**2)
+
+        outside = f(0.)>0 # False for nan centers
+        if not outside.any():
+            return None
+
+        t_a = 0.
+        for k in range(1, n_samples+1):
+            t_b = dt*k/n_samples
+            crossing = np.flatnonzero(outside & (f(t_b)<=0))
+            if len(crossing)>0:
+                tau = min(brentq(lambda tau: f(tau, [i])[0], t_a, t_b,
+                                 xtol=1e-12)
+                          for i in crossing)
+                return min(tau + 1e-9, t_b)
+            t_a = t_b
+
+        return None
+
+    def sense(self):
+        ''' Gather current readings from the fleet's sensors
+        '''
+        if len(self.readings)!=len(self.sensors): # Sensors were replaced
+            self.readings = [None for sensor in self.sensors]
+
+        for (i, sensor) in enumerate(self.sensors):
+            sensor.update_readings(self.p, self.t, self.u, self.dt)
+            self.readings[i] = sensor.current_readings
 
-        return [sensor.current_readings for sensor in self.sensors]
+        return self.readings
@@ -0,0 +1,223 @@
+'''
+Real-time execution of the simulation loop with asyncio
+
+The control/plant/observe cycle is run on a fixed schedule of the monotonic
+clock, with deadline tracking and jitter statistics. The plant can be a
+local Cart, or a stand-in robot running in a separate process and reached
+over a socket without blocking the loop.
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+from plant import Cart
+from timing import PhaseStats
+from telemetry import TIMING_OVERRUN
+from bridge import Message, CMD, POSE
+import asyncio
+
+class RealTimeLoop:
+    ''' Run a headless Simulator on a real-time schedule
+
+        Detail:
+          Cycle k is due at t0 + k*period on the monotonic clock. The loop
+          sleeps until each deadline, so that errors do not accumulate as
+          with relative sleeps. A cycle still running at its next deadline
+          is an overrun, reported on the simulator's telemetry channel. The
+          missed deadlines are then handled according to the policy:
+             * "catchup": the missed cycles are run back to back, up to
+               max_catchup of them, beyond which the schedule is reset
+             * "skip": the missed cycles are dropped and the next cycle
+               covers their simulated time in one step
+
+          The lateness of each wake-up and the duration of each cycle are
+          kept in a PhaseStats (phases "wakeup" and "cycle"). As the event
+          loop only wakes up with a millisecond resolution, the last spin
+          seconds before a deadline are spent yielding to the other tasks
+          instead of sleeping.
+
+        Inputs:
+          - sim: Simulator, created with headless=True
+          - period: cycle period in seconds, defaults to the simulation
+                    period of sim
+          - policy: "catchup" or "skip"
+          - max_catchup: maximal number of missed cycles run back to back
+          - spin: duration of the busy wait before each deadline
+    '''
+    def __init__(self, sim, period=None, policy="catchup", max_catchup=5,
+                 spin=0.002):
+        if policy not in ["catchup", "skip"]:
+            raise ValueError("Unknown policy: {}".format(policy))
+
+        self.sim = sim
+        self.period = period or sim.sim_attr["period"]
+        self.policy = policy
+        self.max_catchup = max_catchup
+        self.spin = spin
+
+        self.stats = PhaseStats(["wakeup", "cycle"])
+        self.n_cycles = 0
+        self.skipped = 0
+
+    async def run(self):
+        ''' Run cycles until the simulation is complete
+
+            Output:
+              - trajectory: see Simulator.run(). None if the simulator does
+                            not record
+        '''
+        sim = self.sim
+        period = self.period
+        stats = self.stats
+        clock = time.monotonic
+
+        t0 = clock()
+        k = 0 # Index of the next deadline
+        while not sim.sim_complete:
+            deadline = t0 + k*period
+            delay = deadline - clock()
+            if delay>self.spin:
+                await asyncio.sleep(delay - self.spin)
+            await asyncio.sleep(0) # Let the socket tasks run
+            while clock()<deadline:
+                await asyncio.sleep(0)
+
+            t_start = clock()
+            stats.record("wakeup", max(t_start - deadline, 0.))
+
+            # Missed deadlines since the previous cycle
+            missed = int((t_start - deadline)//period)
+            dt = period
+            if missed>0 and self.policy=="skip":
+                dt = (missed + 1)*period
+                k += missed
+                self.skipped += missed
+            elif missed>self.max_catchup:
+                t0 = t_start - k*period # Reset the schedule
+                self.skipped += missed
+
+            sim.sim_step(dt)
+            self.n_cycles += 1
+            k += 1
+
+            t_end = clock()
+            stats.record("cycle", t_end - t_start)
+            if t_end>t0 + k*period:
+                stats.overruns += 1
+                sim.telemetry.emit(TIMING_OVERRUN,
+                                   t=sim.sim_t,
+                                   value=t_end - deadline)
+
+        if sim.recorder is not None:
+            return sim.recorder.trajectory()
+
+
+class RemoteCart(Cart):
+    ''' Cart whose motion is computed by a stand-in robot process
+
+        Detail:
+          step() does not integrate the motion: it queues the command for
+          the robot and returns immediately. A background task updates the
+          state p each time the robot replies with its pose, so readings
+          lag the commands by the round trip time, as with real hardware.
+          Messages follow the bridge protocol (see bridge.py), so the robot
+          can be a plant server started by bridge.start_plant(). Must be
+          connected from within the running event loop.
+
+        Inputs:
+          - p0, L, r: as for Cart. They must match the robot's
+    '''
+    def __init__(self, p0=[0., 0., 0.], L=1.0, r=1.0):
+        Cart.__init__(self, p0, L, r)
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.cmd = Message(CMD)
+        self.pose = Message(POSE)
+        self.seq = 0
+        self.robot_t = 0. # Robot time of the last pose
+        self.n_poses = 0
+
+    async def connect(self, address):
+        ''' Connect to the robot at address, (host, port) or a UNIX socket
+            path
+        '''
+        if isinstance(address, str):
+            (self.reader, self.writer) = await asyncio.open_unix_connection(
+                                                                      address)
+        else:
+            (self.reader, self.writer) = await asyncio.open_connection(
+                                                                     *address)
+        self.task = asyncio.create_task(self.receive())
+
+    async def receive(self):
+        ''' Update the state with the poses sent by the robot
+        '''
+        try:
+            while True:
+                pose = self.pose
+                pose.view[:] = await self.reader.readexactly(len(pose.view))
+                pose.unpack()
+                self.p = pose.payload[0].copy()
+                self.robot_t = pose.t
+                self.n_poses += 1
+        except asyncio.IncompleteReadError:
+            pass # Robot disconnected
+
+    def step(self, u, dt):
+        ''' Send the command to the robot, without waiting for its reply
+        '''
+        self.u = u
+        self.dt = dt
+        self.t += dt
+        self.cmd.payload[0] = u
+        self.writer.write(self.cmd.pack(self.seq, self.t - dt, dt))
+        self.seq += 1
+
+    async def close(self):
+        ''' Disconnect from the robot
+        '''
+        self.writer.close()
+        await self.writer.wait_closed()
+        if self.task is not None:
+            await self.task
+
+
+if __name__=="__main__":
+    from simulator import Simulator
+    from controller import ClosedLoopCtrl
+    from bridge import start_plant
+
+    address = ("127.0.0.1", 8765)
+    p0 = [-3., 5., -pi/4]
+    path=[(0.0, 0.0),
+          (4.0, 0.0),
+          (3.0, -3.0),
+          (1.0, -2.0),
+          (-2.0, 0.0)]
+
+    async def main():
+        robot = start_plant(address, p0)
+
+        cart = RemoteCart(p0=p0)
+        await cart.connect(address)
+        sim = Simulator(cart,
+                        controller=ClosedLoopCtrl(cart, reference=path),
+                        sim_timeout=30.,
+                        headless=True,
+                        verbose=True)
+        loop = RealTimeLoop(sim, period=0.01)
+        await loop.run()
+
+        await cart.close()
+        robot.join()
+        print(loop.stats)
+        print("cycles: {}, skipped: {}, robot poses: {}".format(
+                loop.n_cycles, loop.skipped, cart.n_poses))
+
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+'''
+Trajectory recorder for the simulation history
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+
+class TrajectoryRecorder:
+    ''' Columnar recorder of the simulation history
+
+        Detail:
+          Each column is a preallocated NumPy array whose first axis is the
+          sample index. The capacity doubles whenever it is exceeded, so that
+          long runs only reallocate a logarithmic number of times. The
+          shape and type of each column are taken from its first sample,
+          which allows fleets to be recorded as well as single carts.
+
+          Recorded columns:
+            - t: simulation time
+            - p: true state at t
+            - p_est: estimated state at t
+            - u: command applied during the step ending at t (nan for the
+                 initial sample)
+            - wp_idx: index of the active waypoint at t (-1 if the
+                      controller has none)
+
+        Inputs:
+          - capacity: initial number of samples allocated
+    '''
+    columns = ["t", "p", "p_est", "u", "wp_idx"]
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.n = 0
+        self.buffers = None
+
+    def allocate(self, sample):
+        ''' Allocate the buffers from the shapes of a first sample
+        '''
+        self.buffers = {}
+        for (name, value) in zip(self.columns, sample):
+            value = asarray(value)
+            dtype = int if value.dtype.kind in "iub" else float
+            self.buffers[name] = np.empty((self.capacity,) + value.shape,
+                                          dtype=dtype)
+
+    def grow(self):
+        ''' Double the capacity of every buffer
+        '''
+        self.capacity *= 2
+        for (name, buf) in self.buffers.items():
+            new_buf = np.empty((self.capacity,) + buf.shape[1:],
+                               dtype=buf.dtype)
+            new_buf[:self.n] = buf[:self.n]
+            self.buffers[name] = new_buf
+
+    def record(self, t, p, p_est, u, wp_idx):
+        ''' Append one sample
+
+            Inputs:
+              - t: simulation time
+              - p: true state
+              - p_est: estimated state
+              - u: applied command
+              - wp_idx: active waypoint index
+        '''
+        sample = (t, p, p_est, u, wp_idx)
+        if self.buffers is None:
+            self.allocate(sample)
+        elif self.n==self.capacity:
+            self.grow()
+
+        for (name, value) in zip(self.columns, sample):
+            self.buffers[name][self.n] = value
+        self.n += 1
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, name):
+        ''' View on the recorded samples of a column
+        '''
+        return self.buffers[name][:self.n]
+
+    def trajectory(self):
+        ''' Recorded true states as an array of rows [t, state]
+        '''
+        return np.hstack((self["t"][:,None], self["p"].reshape(self.n, -1)))
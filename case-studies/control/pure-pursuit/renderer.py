@@ -0,0 +1,105 @@
+'''
+Blitted renderer for the simulation display
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+
+class Renderer:
+    ''' Display of a simulation reusing its artists between frames
+
+        Detail:
+          The axes, grid and waypoints are rendered once into a cached
+          background. Each frame restores the background, draws the
+          moving artists (cart shapes and texts) on top and blits the axes.
+          Texts are only modified when their content changes, and the
+          waypoints colours only when the target waypoint switches, which is
+          the only time the background is rendered again. Without blitting
+          support from the backend, the whole figure is redrawn instead.
+
+        Inputs:
+          - path: list of waypoints to draw, if any
+          - blit: whether blitting is used when available
+    '''
+    def __init__(self, path=None, blit=True):
+        self.path = path
+        self.fig, self.lines = create_display(path)
+        self.ax = self.fig.axes[0]
+        self.canvas = self.fig.canvas
+
+        self.blit = blit and self.canvas.supports_blit
+        self.background = None
+        self.stage = None
+
+        # Artists updated every frame, excluded from the background
+        self.animated = self.lines[:7]
+        self.texts = ["" for e in self.animated]
+        for artist in self.animated:
+            artist.set_animated(self.blit)
+
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+    def on_draw(self, event):
+        ''' Cache the background after a full redraw of the figure
+        '''
+        if self.blit:
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+            self.draw_animated()
+
+    def draw_animated(self):
+        for artist in self.animated:
+            self.ax.draw_artist(artist)
+
+    def set_text(self, i, text):
+        ''' Change the text of artist i if it differs from the current one
+        '''
+        if text!=self.texts[i]:
+            self.texts[i] = text
+            self.lines[i].set_text(text)
+
+    def set_stage(self, stage, sim_end=False):
+        ''' Colour the waypoints for target stage, invalidating the
+            background if the colours change
+        '''
+        if self.path is None or (stage, sim_end)==self.stage:
+            return
+
+        self.stage = (stage, sim_end)
+        self.lines[7].set_color(draw_path(self.path, stage, sim_end))
+        self.background = None
+
+    def update(self, shape, shape_est, t, p=None, status=""):
+        ''' Render one frame
+
+            Inputs:
+              - shape, shape_est: true and estimated cart drawings, as
+                                  (2, K) arrays
+              - t: simulation time
+              - p: state displayed as text, if any
+              - status: text displayed in the top right corner
+        '''
+        self.lines[0].set_data(*shape)
+        self.lines[1].set_data(*shape_est)
+        self.set_text(2, status)
+        self.set_text(3, "t = %.1f" % t)
+        if p is not None:
+            self.set_text(4, "x = %.2f" % p[0])
+            self.set_text(5, "y = %.2f" % p[1])
+            self.set_text(6, "theta = %.1f" % rad2deg(p[2]))
+
+        if not self.blit:
+            self.canvas.draw_idle()
+        elif self.background is None:
+            self.canvas.draw()
+            self.canvas.blit(self.fig.bbox)
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_animated()
+            self.canvas.blit(self.ax.bbox)
+        self.canvas.flush_events()
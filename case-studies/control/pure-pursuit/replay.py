@@ -0,0 +1,149 @@
+'''
+Replay of recorded simulations
+
+The recorded states are displayed without re-running the simulation. Frames
+are decimated to the display rate, so a run can be replayed faster than
+real time, and any instant can be reached by binary search on the time
+column.
+
+Keys:
+  - space: pause / resume
+  - right / left: jump 10 s forward / backward
+  - up / down: double / halve the replay speed
+  - home / end: go to the beginning / end of the run
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+from plant import Cart
+from renderer import Renderer
+
+class Replayer:
+    ''' Class replaying a recorded simulation
+
+        Inputs:
+          - history: recorded simulation, TrajectoryRecorder or
+                     TrajectoryLog
+          - path: list of waypoints to draw. Defaults to the path stored in
+                  the log, if any
+          - L: axle length used to draw the carts. Defaults to the value
+               stored in the log, or 1
+          - speed: replay speed, as a multiple of real time
+          - fps: display rate in frames per second
+    '''
+    def __init__(self,
+                 history,
+                 path=None,
+                 L=None,
+                 speed=1.,
+                 fps=20.):
+        self.history = history
+        self.t = history["t"]
+
+        if path is None:
+            path = getattr(history, "path", None)
+        if path is not None and (len(path)==0 or asarray(path).ndim!=2):
+            path = None
+        self.path = path
+
+        if L is None:
+            L = getattr(history, "L", 1.)
+        self.hom_shape = Cart(L=L).hom_shape
+
+        self.speed = speed
+        self.fps = fps
+        self.paused = False
+        self.replay_t = self.t[0]
+
+    def index_at(self, t):
+        ''' Index of the last sample recorded at or before time t
+        '''
+        i = np.searchsorted(self.t, t, side="right") - 1
+
+        return min(max(i, 0), len(self.t)-1)
+
+    def seek(self, t):
+        ''' Move the replay to time t, clipped to the recorded interval
+        '''
+        self.replay_t = min(max(t, self.t[0]), self.t[-1])
+
+    def outlines(self, p):
+        ''' Outlines of one or several carts as a single polyline, the
+            carts being separated by nan
+        '''
+        M = transform_patterns(self.hom_shape, p)
+        M = np.concatenate((M, np.full((len(M), 2, 1), np.nan)), axis=2)
+
+        return M.transpose(1, 0, 2).reshape(2, -1)
+
+    def draw(self, i):
+        ''' Update the display with sample i
+        '''
+        p = self.history["p"][i]
+        p_est = self.history["p_est"][i]
+        wp_idx = self.history["wp_idx"][i]
+
+        if np.ndim(wp_idx)==0:
+            self.renderer.set_stage(int(wp_idx), i==len(self.t)-1)
+        self.renderer.update(self.outlines(p),
+                             self.outlines(p_est),
+                             self.t[i],
+                             p if p.ndim==1 else None,
+                             "x{:g}{}".format(self.speed,
+                                              " (paused)" if self.paused
+                                              else ""))
+
+    def step(self):
+        ''' Animation step: advance the replay time by one display period
+        '''
+        if not self.paused:
+            self.seek(self.replay_t + self.speed/self.fps)
+
+        self.draw(self.index_at(self.replay_t))
+
+    def on_key(self, event):
+        ''' Keyboard controls of the replay
+        '''
+        if event.key==" ":
+            self.paused = not self.paused
+        elif event.key=="right":
+            self.seek(self.replay_t + 10.)
+        elif event.key=="left":
+            self.seek(self.replay_t - 10.)
+        elif event.key=="up":
+            self.speed *= 2
+        elif event.key=="down":
+            self.speed /= 2
+        elif event.key=="home":
+            self.seek(self.t[0])
+        elif event.key=="end":
+            self.seek(self.t[-1])
+
+    def show(self):
+        ''' Open the replay window
+        '''
+        self.renderer = Renderer(self.path)
+        self.renderer.canvas.mpl_connect("key_press_event", self.on_key)
+
+        self.timer = self.renderer.canvas.new_timer(interval=1000./self.fps)
+        self.timer.add_callback(self.step)
+        self.timer.start()
+        show()
+
+
+if __name__=="__main__":
+    from trajlog import TrajectoryLog
+    import sys
+
+    if len(sys.argv)<2:
+        print("Usage: python replay.py log_file [speed]")
+        sys.exit(1)
+
+    speed = float(sys.argv[2]) if len(sys.argv)>2 else 1.
+    Replayer(TrajectoryLog(sys.argv[1]), speed=speed).show()
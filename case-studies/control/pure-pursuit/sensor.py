@@ -13,6 +13,7 @@ license: GNU GPL
 #!/usr/bin/env python
 
 from lib import *
+from collections import deque
 
 class PerfectSensor:
     ''' PerfectSensor class
@@ -23,5 +24,173 @@ class PerfectSensor:
     def __init__(self):
         self.current_readings = None
 
-    def update_readings(self, p):
+    def update_readings(self, p, t=0., u=None, dt=0.):
         self.current_readings = p
+
+
+class NoiseBlock:
+    ''' Source of standard normal noise drawn in blocks
+
+        Detail:
+          Samples are generated by a seeded numpy.random.Generator, a whole
+          block at a time, and handed out in slices, so that sensors do not
+          call the generator at every step. Runs with the same seed are
+          reproducible.
+
+        Inputs:
+          - seed: seed of the generator
+          - block: number of samples generated at once
+    '''
+    def __init__(self, seed=None, block=4096):
+        self.rng = np.random.default_rng(seed)
+        self.block = block
+        self.samples = np.empty(0)
+        self.i = 0
+
+    def draw(self, shape):
+        ''' Next standard normal samples, with the given shape
+        '''
+        n = int(np.prod(shape))
+        if self.i + n>len(self.samples):
+            self.samples = self.rng.standard_normal(max(self.block, n))
+            self.i = 0
+
+        samples = self.samples[self.i:self.i+n]
+        self.i += n
+
+        return samples.reshape(shape)
+
+
+class PeriodicSensor:
+    ''' Base class of the sensors sampled at their own rate
+
+        Detail:
+          Between two samples, the last readings are held
+
+        Inputs:
+          - rate: sampling rate in Hz. If None, a sample is taken at every
+                  update
+          - seed: seed of the noise generator
+    '''
+    def __init__(self, rate=None, seed=None):
+        self.current_readings = None
+        self.period = None if rate is None else 1./rate
+        self.n_next = 0 # Index of the next sampling instant
+        self.noise = NoiseBlock(seed)
+
+    def is_due(self, t):
+        ''' Whether a new sample must be taken at time t
+        '''
+        if self.period is None or self.current_readings is None:
+            return True
+        return t>=self.n_next*self.period - 1e-9
+
+    def update_readings(self, p, t=0., u=None, dt=0.):
+        if self.is_due(t):
+            self.sample(p, t, u, dt)
+            if self.period is not None: # Next sampling instant after t
+                self.n_next = int(np.floor(t/self.period + 1e-9)) + 1
+
+
+class GaussianPoseSensor(PeriodicSensor):
+    ''' GaussianPoseSensor class
+
+        Detail:
+          Complete state corrupted by additive Gaussian noise. Works for a
+          single Cart as well as for a CartFleet
+
+        Inputs:
+          - sigma: standard deviations of the noise on (x, y, theta)
+          - rate: sampling rate in Hz, None to sample at every update
+          - seed: seed of the noise generator
+    '''
+    def __init__(self, sigma=(0.05, 0.05, 0.02), rate=None, seed=None):
+        PeriodicSensor.__init__(self, rate, seed)
+        self.sigma = asarray(sigma, dtype="float")
+
+    def sample(self, p, t, u, dt):
+        readings = p + self.sigma*self.noise.draw(np.shape(p))
+        readings[...,2] = normalize(readings[...,2])
+        self.current_readings = readings
+
+
+class OdometrySensor(PeriodicSensor):
+    ''' OdometrySensor class
+
+        Detail:
+          Dead reckoning pose from noisy measurements of the wheel speeds,
+          integrated with the exact arc solution from the initial state.
+          The error therefore grows with the distance travelled
+
+        Inputs:
+          - L: axle length
+          - r: wheel diameter
+          - sigma: standard deviation of the noise on the wheel angular
+                   speeds
+          - seed: seed of the noise generator
+    '''
+    def __init__(self, L=1.0, r=1.0, sigma=0.05, seed=None):
+        PeriodicSensor.__init__(self, None, seed)
+        self.L = L
+        self.r = r
+        self.sigma = sigma
+
+    def sample(self, p, t, u, dt):
+        if self.current_readings is None or u is None:
+            self.current_readings = array(p, dtype="float")
+            return
+
+        u = asarray(u, dtype="float")
+        u = u + self.sigma*self.noise.draw(u.shape)
+        v = self.r/2 * (u[...,0] + u[...,1])
+        w = self.r*(u[...,0] - u[...,1])/self.L
+
+        p_odo = self.current_readings
+        dth = w*dt
+        th_mid = p_odo[...,2] + dth/2
+        chord = v*dt*np.sinc(dth/(2*pi))
+
+        readings = np.empty_like(p_odo)
+        readings[...,0] = p_odo[...,0] + chord*cos(th_mid)
+        readings[...,1] = p_odo[...,1] + chord*sin(th_mid)
+        readings[...,2] = normalize(p_odo[...,2] + dth)
+        self.current_readings = readings
+
+
+class GPSSensor(PeriodicSensor):
+    ''' GPSSensor class
+
+        Detail:
+          Noisy planar position (x, y), sampled at a low rate and delivered
+          after a latency. Until the first sample is delivered, the readings
+          are None
+
+        Inputs:
+          - sigma: standard deviation of the position noise
+          - rate: sampling rate in Hz
+          - latency: delay between a sample and its delivery, in seconds
+          - seed: seed of the noise generator
+    '''
+    def __init__(self, sigma=0.5, rate=1., latency=0.2, seed=None):
+        PeriodicSensor.__init__(self, rate, seed)
+        self.sigma = sigma
+        self.latency = latency
+        self.pending = deque() # (delivery time, readings)
+        self.sampled = False
+
+    def is_due(self, t):
+        if not self.sampled:
+            return True
+        return t>=self.n_next*self.period - 1e-9
+
+    def sample(self, p, t, u, dt):
+        p = asarray(p)
+        noise = self.sigma*self.noise.draw(p[...,:2].shape)
+        self.pending.append((t + self.latency, p[...,:2] + noise))
+        self.sampled = True
+
+    def update_readings(self, p, t=0., u=None, dt=0.):
+        PeriodicSensor.update_readings(self, p, t, u, dt)
+
+        while self.pending and self.pending[0][0]<=t + 1e-9:
+            self.current_readings = self.pending.popleft()[1]
@@ -13,6 +13,11 @@ license: GNU GPL
 from lib import *
 from controller import OpenLoopCtrl
 from observer import IdealObs
+from timing import PhaseStats
+from recorder import TrajectoryRecorder
+from trajlog import TrajectoryLogWriter
+from renderer import Renderer
+from telemetry import EventChannel, TIMING_OVERRUN
 
 class Simulator:
     ''' Class executing the simulation of the specified parts
@@ -24,8 +29,32 @@ class Simulator:
           - observer: state estimator of the system
           - sim_timeout: timeout after which the simulation will stop, whether
                          or not the controller has reached the final target
-          - sim_p: simulation step
+          - sim_p: simulation step, i.e. display period
           - sim_speed: simulation speed
+          - physics_p: if specified, fixed physics step. The simulated time
+                       elapsed between two displayed frames is then covered
+                       by as many fixed substeps as needed, instead of a
+                       single step of variable length
+          - control_p: if specified, period at which new commands are
+                       generated, the last command being held in between.
+                       Defaults to one command per physics step
+          - max_substeps: maximum number of physics substeps per displayed
+                          frame. Beyond it, the simulation falls behind real
+                          time rather than freezing the display
+          - headless: if True, no display is created and the simulation is
+                      only executed through run()
+          - timing: if True, the duration of each phase of the loop is
+                    recorded in the stats attribute
+          - record: if True, the history of the simulation is kept in the
+                    recorder attribute. Enabled by run() unless a log
+                    file is recorded
+          - log_file: if specified, the history of the simulation is also
+                      streamed to this file in the binary trajectory log
+                      format (see trajlog.py)
+          - verbose: if True, events (waypoint switches, timing overruns...)
+                     are printed as they occur. Defaults to True with a
+                     display and to False in headless mode. In any case they
+                     are kept in the telemetry channel, to be drained
     '''
     def __init__(self,
                  cart,
@@ -33,7 +62,15 @@ class Simulator:
                  observer=None,
                  sim_timeout=100.,
                  sim_p=1./20.,
-                 sim_speed=1.):
+                 sim_speed=1.,
+                 physics_p=None,
+                 control_p=None,
+                 max_substeps=100,
+                 headless=False,
+                 timing=False,
+                 record=True,
+                 log_file=None,
+                 verbose=None):
 
 
         # ----------------------------------------------------------------
@@ -51,103 +88,280 @@ class Simulator:
         else:
             self.observer = IdealObs(self.cart) # Default
 
+        # ----------------------------------------------------------------
+        # Event channel, shared with the controller
+        if verbose is None:
+            verbose = not headless
+        self.telemetry = EventChannel(echo=verbose)
+        if hasattr(self.controller, "telemetry"):
+            for event in self.controller.telemetry.drain():
+                self.telemetry.push(event)
+            self.controller.telemetry = self.telemetry
+
         # ----------------------------------------------------------------
         # Simulation attributes
         self.sim_attr = {"speed": sim_speed,
                          "timeout": sim_timeout,
-                         "period": sim_p}
+                         "period": sim_p,
+                         "physics_period": physics_p,
+                         "control_period": control_p,
+                         "max_substeps": max_substeps}
 
         self.t = time.time()
         self.sim_t = 0.
         self.sim_complete = False
         self.loop_dt = 0.
+        self.accumulator = 0. # Simulated time not yet covered by substeps
+        self.n_control = 0 # Index of the next control instant
+        self.u = None # Command held between control periods
+        self.stats = PhaseStats(["control", "plant", "observe", "check",
+                                 "record", "display"],
+                                enabled=timing)
+
+        self.recorder = TrajectoryRecorder() if record else None
+        self.log = None
+        if log_file is not None:
+            self.log = TrajectoryLogWriter(log_file,
+                                           self.cart,
+                                           self.controller)
+        self.record(self.no_cmd())
+
+        if not headless:
+            self.init_display()
+
+            # ------------------------------------------------------------
+            # Launch simulation
+            interval = sim_p*1000
+            self.timer = self.renderer.canvas.new_timer(interval=interval)
+            self.timer.add_callback(self.step)
+            self.renderer.canvas.mpl_connect("close_event", self.close)
+            self.timer.start()
+            show()
+
+    def init_display(self):
+        ''' Create display elements
+        '''
+        path = None
+        if self.controller.type in ["closed-loop", "pure-pursuit"]:
+            path = self.controller.path
+
+        self.renderer = Renderer(path)
+
+    def sim_step(self, dt, events=False):
+        ''' Execute one control/plant/observe cycle of length dt
+
+            Inputs:
+              - dt: simulated time covered by the cycle
+              - events: if True, the cycle is shortened to end at the first
+                        event within dt, see next_event()
+
+            Output:
+              - u: control inputs applied during the cycle
+        '''
+        stats = self.stats
+        stats.start()
 
         # ----------------------------------------------------------------
-        # Create display elements
-        fig = figure()
-        ax = fig.add_subplot(111,
-                             aspect="equal",
-                             autoscale_on=False,
-                             xlim=(-10, 10),
-                             ylim=(-7, 10))
-        ax.grid()
-
-        self.lines = (ax.plot([], [], color="b", lw=2)[0],
-                      ax.plot([], [], color="r", lw=2)[0],
-                      ax.text(0.75, 0.95, "", transform=ax.transAxes),
-                      ax.text(0.02, 0.95, "", transform=ax.transAxes),
-                      ax.text(0.02, 0.90, "", transform=ax.transAxes),
-                      ax.text(0.02, 0.85, "", transform=ax.transAxes),
-                      ax.text(0.02, 0.80, "", transform=ax.transAxes))
-
-        if self.controller.type in ["closed-loop"]:
-            self.lines += (ax.scatter([e[0] for e in self.controller.path],
-                                      [e[1] for e in self.controller.path],
-                                      marker="o",
-                                      s=[100]*len(self.controller.path)),)
+        # [Control] Generate current control inputs, at the control rate
+        control_p = self.sim_attr["control_period"]
+        if (control_p is None or self.u is None
+            or self.sim_t>=self.n_control*control_p - 1e-9):
+            self.u = self.controller.generate_cmd(self.observer.p, self.sim_t)
+            if control_p is not None: # Next control instant after sim_t
+                self.n_control = int(np.floor(self.sim_t/control_p + 1e-9))+1
+        u = self.u
+        stats.lap("control")
+
+        # ----------------------------------------------------------------
+        # [Simulate] Compute the new system state
+        if events:
+            (dt, t_next) = self.next_event(u, dt)
+        else:
+            t_next = self.sim_t + dt
+        self.sim_t = t_next
+        self.cart.step(u, dt) # Plant step
+        stats.lap("plant")
 
         # ----------------------------------------------------------------
-        # Launch simulation
-        interval = sim_p*1000
-        self.anim = FuncAnimation(fig,
-                                  self.step,
-                                  frames=300,
-                                  interval=interval,
-                                  blit=False)
-        show()
-
-    def step(self, i):
+        # [Observe] Compute the new estimate of the system state
+        self.observer.update_est(self.cart.sense(),
+                                 dt) # New state estimate
+        stats.lap("observe")
+
+        # ----------------------------------------------------------------
+        # Check if simulation is finished
+        self.sim_complete = (self.controller.is_end
+                             or (self.sim_t>self.sim_attr["timeout"]))
+        stats.lap("check")
+
+        # ----------------------------------------------------------------
+        # Keep track of the simulation history
+        self.record(u)
+        if self.sim_complete:
+            self.close()
+        stats.lap("record")
+
+        return u
+
+    def next_event(self, u, dt):
+        ''' Locate the first event occurring within the next dt
+
+            Detail:
+              Events are the command switches of a controller schedule
+              (switch_times), the entry of the cart in the target zone of the
+              controller (target_zone), located by root-finding on the
+              analytic trajectory under command u, and the next control
+              instant when a control period is set.
+
+            Output:
+              - dt: duration until the first event, or the input dt
+              - t_next: simulation time at the end of the step, exactly equal
+                        to the event time for time-based events
+        '''
+        t0 = self.sim_t
+        t_next = t0 + dt
+
+        control_p = self.sim_attr["control_period"]
+        if control_p is not None:
+            t_next = min(t_next, self.n_control*control_p)
+
+        if hasattr(self.controller, "switch_times"):
+            switches = self.controller.switch_times(t0, t_next)
+            if len(switches)>0:
+                t_next = float(switches[0])
+
+        zone = getattr(self.controller, "target_zone", lambda: None)()
+        if zone is not None:
+            tau = self.cart.time_to_zone(u, zone[0], zone[1], t_next - t0)
+            if tau is not None:
+                t_next = t0 + tau
+
+        return t_next - t0, t_next
+
+    def no_cmd(self):
+        ''' Command of the initial sample, when none has been applied yet:
+            nan with the shape of the commands
+        '''
+        u = asarray(self.controller.transform(0., 0.), dtype="float")
+        return np.full_like(u, np.nan)
+
+    def sample(self, u):
+        ''' Current simulation state and command u, as recorded
+        '''
+        return (self.sim_t,
+                self.cart.p,
+                self.observer.p,
+                u,
+                getattr(self.controller, "wp_idx", -1))
+
+    def record(self, u):
+        ''' Add the current sample to the recorder and to the log file,
+            when enabled
+        '''
+        if self.recorder is not None:
+            self.recorder.record(*self.sample(u))
+        if self.log is not None:
+            self.log.write(*self.sample(u))
+
+    def run(self, dt=None, events=False):
+        ''' Headless simulation with a fixed time step
+
+            Detail:
+              The loop is executed as fast as possible, independently of the
+              wall clock, until the controller ends or the timeout is hit.
+              Runs with the same inputs are therefore reproducible.
+
+            Inputs:
+              - dt: fixed simulation step. Defaults to the physics period if
+                    specified, to the simulation period otherwise
+              - events: if True, dt is a maximum step and steps end at the
+                        events (command switches, waypoint arrivals) instead,
+                        so that large steps can be taken between them
+
+            Output:
+              - trajectory: array of rows [t, x, y, theta], including the
+                            initial state. For a CartFleet, the states of
+                            all the carts follow t on each row. The full
+                            history is available in the recorder attribute.
+                            None if only a log file is recorded
+        '''
+        if dt is None:
+            dt = self.sim_attr["physics_period"] or self.sim_attr["period"]
+
+        if self.recorder is None and self.log is None:
+            self.recorder = TrajectoryRecorder()
+            self.recorder.record(*self.sample(self.no_cmd()))
+
+        try:
+            while not self.sim_complete:
+                self.sim_step(dt, events)
+        finally:
+            self.close()
+
+        if self.recorder is not None:
+            return self.recorder.trajectory()
+
+    def close(self, event=None):
+        ''' Flush and close the log file, if any
+
+            Detail:
+              Called when the simulation completes, when run() exits, even
+              on an error, and when the display window is closed
+        '''
+        if self.log is not None:
+            self.log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def step(self):
         ''' Simulation step
         '''
         if self.sim_complete:
-            self.anim._stop()
+            self.timer.stop()
         else:
             t1 = time.time()
 
             # ----------------------------------------------------------------
-            # [Control] Generate current control inputs
-            u = self.controller.generate_cmd(self.observer.p, self.sim_t)
-
-            # ----------------------------------------------------------------
-            # [Simulate] Compute the new system state
+            # [Control/Simulate/Observe] Steps paced by the wall clock
             t = time.time()
             sim_dt = self.sim_attr["speed"]*(t - self.t)
             self.t = t
-            self.sim_t += sim_dt
-
-            self.cart.step(u, sim_dt) # Plant step
-
-            # ----------------------------------------------------------------
-            # [Observe] Compute the new estimate of the system state
-            self.observer.update_est(self.cart.sense(),
-                                     sim_dt) # New state estimate
 
-
-            # ----------------------------------------------------------------
-            # Check if simulation is finished
-            self.sim_complete = (self.controller.is_end
-                                 or (self.sim_t>self.sim_attr["timeout"]))
+            physics_p = self.sim_attr["physics_period"]
+            if physics_p is None:
+                self.sim_step(sim_dt)
+            else:
+                self.accumulator += sim_dt
+                n_substeps = 0
+                while (self.accumulator>=physics_p and not self.sim_complete
+                       and n_substeps<self.sim_attr["max_substeps"]):
+                    self.sim_step(physics_p)
+                    self.accumulator -= physics_p
+                    n_substeps += 1
+                if n_substeps==self.sim_attr["max_substeps"]:
+                    self.accumulator = 0.
 
             # ----------------------------------------------------------------
             # Update display
-            self.lines[0].set_data(self.cart.shape[0],
-                                   self.cart.shape[1])
-            self.lines[1].set_data(self.observer.shape[0],
-                                   self.observer.shape[1])
-            self.lines[3].set_text("t = %.1f" % (self.sim_t))
-            self.lines[4].set_text("x = %.2f" % self.cart.p[0])
-            self.lines[5].set_text("y = %.2f" % self.cart.p[1])
-            self.lines[6].set_text("theta = %.1f"%rad2deg(self.cart.p[2]))
-            if self.controller.type in ["closed-loop"]:
-                new_colours = draw_path(self.controller.path,
-                                        self.controller.wp_idx,
+            self.stats.start() # Frames may run no substep at all
+            if self.controller.type in ["closed-loop", "pure-pursuit"]:
+                self.renderer.set_stage(self.controller.wp_idx,
                                         self.sim_complete)
-                self.lines[7].set_color(new_colours)
+            self.renderer.update(self.cart.shape,
+                                 self.observer.shape,
+                                 self.sim_t,
+                                 self.cart.p)
+            self.stats.lap("display")
 
             # ----------------------------------------------------------------
             # Check for jam in the simulation
             self.loop_dt = time.time() - t1
             if self.loop_dt>self.sim_attr["period"]:
-                print("/!\ Loop duration exceeds timestep: {}".format(t2-t1))
-
-            return self.lines
+                self.stats.overruns += 1
+                self.telemetry.emit(TIMING_OVERRUN,
+                                    t=self.sim_t,
+                                    value=self.loop_dt)
@@ -0,0 +1,137 @@
+'''
+Parameter sweep of the closed loop controller over gains, speeds, cart
+parameters, initial poses and paths
+
+Each configuration is simulated headless and the simulations are fanned
+out over a process pool. The metrics of all the runs are gathered in one
+table.
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+from plant import Cart
+from simulator import Simulator
+from controller import ClosedLoopCtrl
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import os
+
+# Columns of the result table
+SWEEP_DTYPE = [("K", "f8"),
+               ("v", "f8"),
+               ("wp_tol", "f8"),
+               ("L", "f8"),
+               ("r", "f8"),
+               ("p0_idx", "i8"),
+               ("path_idx", "i8"),
+               ("t_finish", "f8"),
+               ("path_err_mean", "f8"),
+               ("path_err_max", "f8"),
+               ("saturation", "f8")]
+
+def run_episode(config):
+    ''' Run one headless closed loop simulation and compute its metrics
+
+        Inputs:
+          - config: dictionnary with keys K, v, wp_tol, L, r, p0, path, dt,
+                    timeout and u_max
+
+        Output:
+          - metrics: tuple (t_finish, path_err_mean, path_err_max,
+                     saturation), where t_finish is nan if the final target
+                     was not reached before the timeout and saturation is the
+                     fraction of steps where a wheel speed exceeds u_max
+    '''
+    cart = Cart(p0=config["p0"],
+                L=config["L"],
+                r=config["r"],
+                integrator="exact")
+
+    controller = ClosedLoopCtrl(cart,
+                                reference=config["path"],
+                                K=config["K"],
+                                v=config["v"],
+                                wp_tol=config["wp_tol"])
+    sim = Simulator(cart,
+                    controller=controller,
+                    sim_timeout=config["timeout"],
+                    headless=True)
+    sim.run(config["dt"])
+
+    t_finish = sim.sim_t if controller.is_end else np.nan
+    err = dist_to_path(sim.recorder["p"][:,:2], config["path"])
+    u = sim.recorder["u"][1:]
+    saturation = (abs(u).max(axis=1)>config["u_max"]).mean()
+
+    return (t_finish, err.mean(), err.max(), saturation)
+
+def sweep(K=[2.],
+          v=[2.],
+          wp_tol=[0.2],
+          L=[1.],
+          r=[1.],
+          p0=[[0., 0., 0.]],
+          paths=[[(2.0, 0.0), (3.0, -1.0), (0.0, 0.0)]],
+          dt=0.05,
+          timeout=100.,
+          u_max=4.,
+          max_workers=None):
+    ''' Simulate every combination of the parameter grids in parallel
+
+        Inputs:
+          - K, v, wp_tol: grids of controller gain, cruise speed and waypoint
+                          tolerance
+          - L, r: grids of cart axle length and wheel diameter
+          - p0: list of initial states [x, y, theta]
+          - paths: list of paths, each a list of (x, y) waypoints
+          - dt: fixed simulation step
+          - timeout: simulated time after which a run is stopped
+          - u_max: wheel angular speed limit used for the saturation metric
+          - max_workers: number of processes, defaults to all the cores
+
+        Output:
+          - table: structured array with one row per configuration, see
+                   SWEEP_DTYPE. Initial poses and paths are referred to by
+                   their index in p0 and paths
+    '''
+    grid = list(product(K, v, wp_tol, L, r,
+                        range(len(p0)), range(len(paths))))
+    configs = [{"K": k, "v": v_, "wp_tol": tol, "L": l, "r": r_,
+                "p0": p0[i], "path": paths[j],
+                "dt": dt, "timeout": timeout, "u_max": u_max}
+               for (k, v_, tol, l, r_, i, j) in grid]
+
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    chunksize = max(1, len(configs)//(4*max_workers))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        metrics = list(pool.map(run_episode, configs, chunksize=chunksize))
+
+    return array([g + m for (g, m) in zip(grid, metrics)],
+                 dtype=SWEEP_DTYPE)
+
+
+if __name__=="__main__":
+    path=[(0.0, 0.0),
+          (4.0, 0.0),
+          (3.0, -3.0),
+          (1.0, -2.0),
+          (-2.0, 0.0)]
+
+    table = sweep(K=[1., 2., 4.],
+                  v=[1., 2.],
+                  wp_tol=[0.1, 0.2],
+                  p0=[[-3., 5., -pi/4],
+                      [3., 3., pi]],
+                  paths=[path])
+
+    print(" ".join("{:>13}".format(name) for name in table.dtype.names))
+    for row in table:
+        print(" ".join("{:>13.3f}".format(e) for e in row))
@@ -0,0 +1,104 @@
+'''
+Event channel used by the controllers and the simulator to report what
+happens during a run, instead of printing from the loop
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+
+# Event types
+CONTROLLER_LAUNCHED = 0
+NEW_TARGET = 1
+FINAL_TARGET = 2
+TIMING_OVERRUN = 3
+
+EVENT_MESSAGES = {
+    CONTROLLER_LAUNCHED: "\nController launched\n"
+                         "  Path composed of {index} waypoints",
+    NEW_TARGET: "New target: {index}. ({x}, {y})",
+    FINAL_TARGET: "\nFinal target reached\n",
+    TIMING_OVERRUN: "/!\\ Loop duration exceeds timestep: {value}"}
+
+EVENT_DTYPE = np.dtype([("t", "f8"),
+                        ("kind", "i4"),
+                        ("index", "i8"),
+                        ("x", "f8"),
+                        ("y", "f8"),
+                        ("value", "f8")])
+
+class EventChannel:
+    ''' Ring buffer of typed events
+
+        Detail:
+          Events are stored as records of EVENT_DTYPE in a preallocated
+          array and drained in batches. When the buffer is full, the oldest
+          events are overwritten and counted in dropped. Nothing is printed
+          unless echo is enabled, e.g. for interactive runs.
+
+        Inputs:
+          - capacity: number of events kept
+          - echo: if True, each event is also printed when emitted
+    '''
+    def __init__(self, capacity=1024, echo=False):
+        self.buffer = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+        self.echo = echo
+
+    def emit(self, kind, t=np.nan, index=-1, x=np.nan, y=np.nan,
+             value=np.nan):
+        ''' Add an event to the channel
+
+            Inputs:
+              - kind: event type, e.g. NEW_TARGET
+              - t: simulation time of the event
+              - index, x, y, value: payload, whose meaning depends on kind
+        '''
+        capacity = len(self.buffer)
+        if self.count==capacity:
+            self.head = (self.head + 1)%capacity
+            self.count -= 1
+            self.dropped += 1
+
+        self.buffer[(self.head + self.count)%capacity] = (t, kind, index,
+                                                          x, y, value)
+        self.count += 1
+
+        if self.echo:
+            print(format_event(self.buffer[(self.head+self.count-1)
+                                           %capacity]))
+
+    def push(self, event):
+        ''' Add an event record, e.g. drained from another channel
+        '''
+        self.emit(**{name: event[name] for name in EVENT_DTYPE.names})
+
+    def drain(self):
+        ''' Remove and return the pending events, oldest first, as a
+            structured array
+        '''
+        idx = (self.head + np.arange(self.count))%len(self.buffer)
+        events = self.buffer[idx]
+        self.head = 0
+        self.count = 0
+
+        return events
+
+    def __len__(self):
+        return self.count
+
+def format_event(event):
+    ''' Human readable description of an event record
+    '''
+    return EVENT_MESSAGES[int(event["kind"])].format(
+                index=int(event["index"]),
+                x=float(event["x"]),
+                y=float(event["y"]),
+                value=float(event["value"]))
@@ -1,6 +1,12 @@
 '''
-Simulator class for the kinematic model of differential drive mobile robot
-described in model.py
+Benchmark harness for the simulate-control-observe loop
+
+Each element of the loop is timed separately, as well as whole headless
+episodes for a single cart and for fleets of carts. Results are written as
+JSON so that runs can be compared over time.
+
+Usage:
+  python testbench.py [-o results.json] [-r repeat] [-n 10 100 1000]
 
 author: Cyrill Guillemot
 email: cyrill.guillemot@gmail.com
@@ -11,143 +17,302 @@ license: GNU GPL
 #!/usr/bin/env python
 
 from lib import *
-from controller import OpenLoopCtrl
+from plant import Cart, CartFleet
+from simulator import Simulator
+from controller import OpenLoopCtrl, ClosedLoopCtrl, ClosedLoopFleetCtrl, \
+                       PurePursuitCtrl
+from telemetry import NEW_TARGET
 from observer import IdealObs
+from kernel import rollout, HAVE_NUMBA
+import argparse
+import json
+import platform
+import subprocess
 
-class Simulator:
-    ''' Class executing the simulation of the specified parts
+PATH = [(0.0, 0.0),
+        (4.0, 0.0),
+        (3.0, -3.0),
+        (1.0, -2.0),
+        (-2.0, 0.0)]
+P0 = [-3., 5., -pi/4]
+
+def timeit(func, n, repeat):
+    ''' Time n calls of a benchmark body, repeat times
 
         Inputs:
-          - cart: Model object, decribing the plant
-          - controller: Object used to generate the commands to follow a given
-                        reference (wheel speed sequence, path...)
-          - observer: state estimator of the system
-          - sim_timeout: timeout after which the simulation will stop, whether
-                         or not the controller has reached the final target
-          - sim_p: simulation step
-          - sim_speed: simulation speed
+          - func: callable executing the benchmarked code n times
+          - n: number of calls per repetition
+          - repeat: number of repetitions
+
+        Output:
+          - result: dictionnary of per-call timings in seconds
     '''
-    def __init__(self,
-                 cart,
-                 controller=None,
-                 observer=None,
-                 sim_timeout=100.,
-                 sim_p=1./20.,
-                 sim_speed=1.):
-
-
-        # ----------------------------------------------------------------
-        # Set up model, controller, and observer
-
-        self.cart = cart # Model to simulate
-
-        if controller:
-            self.controller = controller # Specified
-        else:
-            self.controller = OpenLoopCtrl(self.cart) # Default
-
-        if observer:
-            self.observer = observer # Specified
-        else:
-            self.observer = IdealObs(self.cart) # Default
-
-        # ----------------------------------------------------------------
-        # Simulation attributes
-        self.sim_attr = {"speed": sim_speed,
-                         "timeout": sim_timeout,
-                         "period": sim_p}
-
-        self.t = time.time()
-        self.sim_t = 0.
-        self.sim_complete = False
-        self.loop_dt = 0.
-
-        # ----------------------------------------------------------------
-        # Create display elements
-        fig = figure()
-        ax = fig.add_subplot(111,
-                             aspect="equal",
-                             autoscale_on=False,
-                             xlim=(-10, 10),
-                             ylim=(-7, 10))
-        ax.grid()
-
-        self.lines = (ax.plot([], [], color="b", lw=2)[0],
-                      ax.plot([], [], color="r", lw=2)[0],
-                      ax.text(0.75, 0.95, "", transform=ax.transAxes),
-                      ax.text(0.02, 0.95, "", transform=ax.transAxes),
-                      ax.text(0.02, 0.90, "", transform=ax.transAxes),
-                      ax.text(0.02, 0.85, "", transform=ax.transAxes),
-                      ax.text(0.02, 0.80, "", transform=ax.transAxes))
-
-        if self.controller.type in ["closed-loop"]:
-            self.lines += (ax.scatter([e[0] for e in self.controller.path],
-                                      [e[1] for e in self.controller.path],
-                                      marker="o",
-                                      s=[100]*len(self.controller.path)),)
-
-        # ----------------------------------------------------------------
-        # Launch simulation
-        interval = sim_p*1000
-        self.anim = FuncAnimation(fig,
-                                  self.step,
-                                  frames=300,
-                                  interval=interval,
-                                  blit=False)
-        show()
-
-    def step(self, i):
-        ''' Simulation step
-        '''
-        if self.sim_complete:
-            self.anim._stop()
-        else:
-            t1 = time.time()
-
-            # ----------------------------------------------------------------
-            # [Control] Generate current control inputs
-            u = self.controller.generate_cmd(self.observer.p, self.sim_t)
-
-            # ----------------------------------------------------------------
-            # [Simulate] Compute the new system state
-            t = time.time()
-            sim_dt = self.sim_attr["speed"]*(t - self.t)
-            self.t = t
-            self.sim_t += sim_dt
-
-            self.cart.step(u, sim_dt) # Plant step
-
-            # ----------------------------------------------------------------
-            # [Observe] Compute the new estimate of the system state
-            self.observer.update_est(self.cart.sense(),
-                                     sim_dt) # New state estimate
-
-
-            # ----------------------------------------------------------------
-            # Check if simulation is finished
-            self.sim_complete = (self.controller.is_end
-                                 or (self.sim_t>self.sim_attr["timeout"]))
-
-            # ----------------------------------------------------------------
-            # Update display
-            self.lines[0].set_data(self.cart.shape[0],
-                                   self.cart.shape[1])
-            self.lines[1].set_data(self.observer.shape[0],
-                                   self.observer.shape[1])
-            self.lines[3].set_text("t = %.1f" % (self.sim_t))
-            self.lines[4].set_text("x = %.2f" % self.cart.p[0])
-            self.lines[5].set_text("y = %.2f" % self.cart.p[1])
-            self.lines[6].set_text("theta = %.1f"%rad2deg(self.cart.p[2]))
-            if self.controller.type in ["closed-loop"]:
-                new_colours = draw_path(self.controller.path,
-                                        self.controller.wp_idx,
-                                        self.sim_complete)
-                self.lines[7].set_color(new_colours)
-
-            # ----------------------------------------------------------------
-            # Check for jam in the simulation
-            self.loop_dt = time.time() - t1
-            if self.loop_dt>self.sim_attr["period"]:
-                print("/!\ Loop duration exceeds timestep: {}".format(t2-t1))
-
-            return self.lines
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func(n)
+        times.append((time.perf_counter() - t)/n)
+    times = array(times)
+
+    return {"n": n,
+            "repeat": repeat,
+            "best": times.min(),
+            "median": float(np.median(times)),
+            "per_sec": 1./times.min()}
+
+# ----------------------------------------------------------------------------
+# Benchmark bodies
+
+def bench_cart_step(integrator):
+    cart = Cart(p0=P0, integrator=integrator)
+    def body(n):
+        for _ in range(n):
+            cart.step((1.2, 0.3), 0.05)
+    return body
+
+def bench_closed_loop_cmd():
+    cart = Cart(p0=P0)
+    controller = ClosedLoopCtrl(cart, reference=PATH)
+    p = cart.p
+    def body(n):
+        for _ in range(n):
+            controller.generate_cmd(p, 0.)
+    return body
+
+def bench_open_loop_cmd():
+    cart = Cart(p0=P0)
+    controller = OpenLoopCtrl(cart)
+    def body(n):
+        for _ in range(n):
+            controller.generate_cmd(cart.p, 1.)
+    return body
+
+def bench_update_est():
+    cart = Cart(p0=P0)
+    observer = IdealObs(cart)
+    readings = cart.sense()
+    def body(n):
+        for _ in range(n):
+            observer.update_est(readings, 0.05)
+    return body
+
+def bench_transform_pattern():
+    M = array(Cart().base_shape)
+    def body(n):
+        for _ in range(n):
+            transform_pattern(M, 1., 2., 0.3)
+    return body
+
+def bench_transform_patterns(N):
+    fleet = CartFleet(p0=np.random.default_rng(0).uniform(-5, 5, (N, 3)))
+    out = np.empty((N,) + fleet.hom_shape[:2].shape)
+    def body(n):
+        for _ in range(n):
+            transform_patterns(fleet.hom_shape, fleet.p, out=out)
+    return body
+
+def bench_fleet_step(N):
+    fleet = CartFleet(p0=np.random.default_rng(0).uniform(-5, 5, (N, 3)))
+    u = np.tile((1.2, 0.3), (N, 1))
+    def body(n):
+        for _ in range(n):
+            fleet.step(u, 0.05)
+    return body
+
+def bench_fleet_cmd(N):
+    fleet = CartFleet(p0=np.random.default_rng(0).uniform(-5, 5, (N, 3)))
+    controller = ClosedLoopFleetCtrl(fleet, reference=PATH)
+    def body(n):
+        for _ in range(n):
+            controller.generate_cmd(fleet.p, 0.)
+    return body
+
+def run_episode(make_sim, dt, stats):
+    ''' Build and run one headless episode, keeping its step count
+    '''
+    sim = make_sim()
+    stats["steps"] = len(sim.run(dt)) - 1
+
+def bench_episode(make_sim, dt, repeat):
+    ''' Time whole headless episodes and report the simulation step rate
+    '''
+    stats = {}
+    result = timeit(lambda n: [run_episode(make_sim, dt, stats)
+                               for _ in range(n)], 1, repeat)
+    result["steps"] = stats["steps"]
+    result["steps_per_sec"] = stats["steps"]/result["best"]
+
+    return result
+
+def single_episode(integrator):
+    def make_sim():
+        cart = Cart(p0=P0, integrator=integrator)
+        return Simulator(cart,
+                         controller=ClosedLoopCtrl(cart, reference=PATH),
+                         headless=True)
+    return make_sim
+
+def fleet_episode(N):
+    def make_sim():
+        p0 = np.random.default_rng(0).uniform(-5, 5, (N, 3))
+        fleet = CartFleet(p0=p0)
+        return Simulator(fleet,
+                         controller=ClosedLoopFleetCtrl(fleet, reference=PATH),
+                         sim_timeout=20.,
+                         headless=True)
+    return make_sim
+
+def bench_fused_episode(N, dt, repeat, timeout=20.):
+    ''' Time whole episodes of N carts run by the fused kernel
+    '''
+    p0 = np.random.default_rng(0).uniform(-5, 5, (N, 3))
+    if N==1:
+        p0 = array([P0])
+    path = array(PATH)
+    n_steps = int(timeout/dt) + 1
+    out = np.empty((n_steps+1, N, 3))
+    stats = {}
+    def body(n):
+        for _ in range(n):
+            (stats["steps"], _) = rollout(p0.copy(), path,
+                                          np.ones(N, dtype=np.int64),
+                                          np.zeros(N, dtype=bool),
+                                          2., 2., 0.2, 1., 1., dt,
+                                          n_steps, out)
+
+    result = timeit(body, 1, repeat)
+    result["steps"] = stats["steps"]
+    result["steps_per_sec"] = stats["steps"]/result["best"]
+
+    return result
+
+# ----------------------------------------------------------------------------
+# Sanity checks
+
+def visited_waypoints(make_controller, dt=0.01):
+    ''' Indices of the waypoints targeted in turn during a demo run
+
+        Inputs:
+          - make_controller: callable building the controller from the cart
+          - dt: fixed simulation step
+
+        Output:
+          - indices: waypoint indices of the NEW_TARGET events, in order
+          - complete: whether the final target was reached
+    '''
+    cart = Cart(p0=P0, integrator="exact")
+    controller = make_controller(cart)
+    sim = Simulator(cart, controller=controller, headless=True)
+    sim.run(dt)
+    events = sim.telemetry.drain()
+
+    return ([int(e["index"]) for e in events if e["kind"]==NEW_TARGET],
+            controller.is_end)
+
+def check_demo_paths():
+    ''' Check that the demo runs of the path followers visit every
+        waypoint of PATH in order, before they are benchmarked
+    '''
+    followers = {
+        "closed_loop": lambda c: ClosedLoopCtrl(c, reference=PATH),
+        "closed_loop_lookahead": lambda c: ClosedLoopCtrl(c, reference=PATH,
+                                                          lookahead=1.),
+        "pure_pursuit": lambda c: PurePursuitCtrl(c, reference=PATH,
+                                                  lookahead=1.)}
+    for (name, make_controller) in followers.items():
+        (indices, complete) = visited_waypoints(make_controller)
+        if indices!=list(range(len(PATH))) or not complete:
+            raise RuntimeError("{} skipped waypoints: targeted {}, "
+                               "complete: {}".format(name, indices, complete))
+
+# ----------------------------------------------------------------------------
+# Harness
+
+def metadata():
+    ''' Describe the environment the benchmarks are run in
+    '''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"],
+                                capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ""
+
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "numba": HAVE_NUMBA,
+            "machine": platform.machine(),
+            "processor": platform.processor()}
+
+def run_benchmarks(fleet_sizes=[10, 100, 1000], repeat=5, n=2000, dt=0.05):
+    ''' Run the whole benchmark suite
+
+        Inputs:
+          - fleet_sizes: numbers of carts for the fleet benchmarks
+          - repeat: number of repetitions of each benchmark
+          - n: number of calls per repetition for the element benchmarks
+          - dt: fixed simulation step of the episodes
+
+        Output:
+          - results: dictionnary of benchmark name to timing results
+    '''
+    results = {}
+
+    elements = {"cart_step_odeint": bench_cart_step("odeint"),
+                "cart_step_exact": bench_cart_step("exact"),
+                "closed_loop_generate_cmd": bench_closed_loop_cmd(),
+                "open_loop_generate_cmd": bench_open_loop_cmd(),
+                "ideal_obs_update_est": bench_update_est(),
+                "transform_pattern": bench_transform_pattern()}
+    for N in fleet_sizes:
+        elements["fleet_step_{}".format(N)] = bench_fleet_step(N)
+        elements["fleet_generate_cmd_{}".format(N)] = bench_fleet_cmd(N)
+        elements["transform_patterns_{}".format(N)] = \
+            bench_transform_patterns(N)
+
+    for (name, body) in elements.items():
+        results[name] = timeit(body, n, repeat)
+
+    for integrator in ["odeint", "exact"]:
+        results["episode_{}".format(integrator)] = \
+            bench_episode(single_episode(integrator), dt, repeat)
+    for N in fleet_sizes:
+        results["episode_fleet_{}".format(N)] = \
+            bench_episode(fleet_episode(N), dt, repeat)
+
+    results["episode_fused"] = bench_fused_episode(1, dt, repeat)
+    for N in fleet_sizes:
+        results["episode_fused_fleet_{}".format(N)] = \
+            bench_fused_episode(N, dt, repeat)
+
+    return results
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-o", "--output", default="bench_results.json",
+                        help="JSON file the results are written to")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="repetitions of each benchmark")
+    parser.add_argument("-c", "--calls", type=int, default=2000,
+                        help="calls per repetition of the element benchmarks")
+    parser.add_argument("-n", "--fleet-sizes", type=int, nargs="*",
+                        default=[10, 100, 1000],
+                        help="numbers of carts of the fleet benchmarks")
+    args = parser.parse_args()
+
+    check_demo_paths()
+    results = run_benchmarks(fleet_sizes=args.fleet_sizes,
+                             repeat=args.repeat,
+                             n=args.calls)
+
+    for (name, res) in results.items():
+        print("{:<28} {:>12.2f} us {:>14.1f} /s".format(name,
+                                                       1e6*res["best"],
+                                                       res["per_sec"]))
+
+    with open(args.output, "w") as f:
+        json.dump({"meta": metadata(), "results": results}, f, indent=2)
+    print("\nResults written to {}".format(args.output))
@@ -0,0 +1,126 @@
+'''
+Timing counters for the phases of the simulation loop
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+from bisect import bisect
+
+class PhaseStats:
+    ''' Per-phase timing statistics
+
+        Detail:
+          Durations are accumulated in log-spaced histograms (10 bins per
+          decade between 100 ns and 10 s), from which percentiles are
+          estimated without keeping every sample. When disabled, start() and
+          lap() return immediately.
+
+          A cycle begins with start() and its phases are lapped in loop
+          order. A lap without a preceding start() in the same cycle, i.e.
+          for a phase not after the previous one, is not recorded, so that
+          no sample spans several cycles.
+
+        Inputs:
+          - phases: names of the timed phases, in loop order
+          - enabled: whether the counters are updated
+    '''
+    def __init__(self, phases, enabled=True):
+        self.phases = list(phases)
+        self.order = {ph: i for (i, ph) in enumerate(self.phases)}
+        self.enabled = enabled
+
+        self.edges = list(np.logspace(-7, 1, 81))
+        self.reset()
+
+    def reset(self):
+        ''' Clear all the counters
+        '''
+        n_bins = len(self.edges) + 1
+        self.hist = {ph: [0]*n_bins for ph in self.phases}
+        self.count = {ph: 0 for ph in self.phases}
+        self.total = {ph: 0. for ph in self.phases}
+        self.max = {ph: 0. for ph in self.phases}
+        self.overruns = 0
+        self.t_lap = None # Time of the previous mark, None outside a cycle
+        self.i_lap = -1 # Order of the previously lapped phase
+
+    def start(self):
+        ''' Mark the beginning of the first phase
+        '''
+        if self.enabled:
+            self.t_lap = time.perf_counter()
+            self.i_lap = -1
+
+    def lap(self, phase):
+        ''' Record the time elapsed since the previous mark for phase
+        '''
+        if self.enabled:
+            t = time.perf_counter()
+            i = self.order[phase]
+            if self.t_lap is None or i<=self.i_lap: # start() was skipped
+                self.t_lap = None
+                return
+            self.record(phase, t - self.t_lap)
+            self.t_lap = t
+            self.i_lap = i
+
+    def record(self, phase, dt):
+        ''' Add one duration sample to the counters of phase
+        '''
+        self.hist[phase][bisect(self.edges, dt)] += 1
+        self.count[phase] += 1
+        self.total[phase] += dt
+        if dt>self.max[phase]:
+            self.max[phase] = dt
+
+    def percentile(self, phase, q):
+        ''' Estimate the q-th percentile of the durations of phase
+
+            Detail:
+              The upper edge of the histogram bin holding the percentile is
+              returned, which is within 26% of the true value.
+        '''
+        count = self.count[phase]
+        if count==0:
+            return np.nan
+
+        rank = q/100.*count
+        cumul = 0
+        for (i, n) in enumerate(self.hist[phase]):
+            cumul += n
+            if cumul>=rank and n>0:
+                break
+        if i==len(self.edges):
+            return self.max[phase]
+
+        return min(self.edges[i], self.max[phase])
+
+    def summary(self):
+        ''' Statistics of each phase: count, mean, max, p50, p90 and p99
+        '''
+        return {ph: {"count": self.count[ph],
+                     "mean": self.total[ph]/max(self.count[ph], 1),
+                     "max": self.max[ph],
+                     "p50": self.percentile(ph, 50),
+                     "p90": self.percentile(ph, 90),
+                     "p99": self.percentile(ph, 99)}
+                for ph in self.phases}
+
+    def __str__(self):
+        lines = ["{:<12}{:>9}{:>12}{:>12}{:>12}{:>12}{:>12}".format(
+                    "phase", "count", "mean (us)", "p50 (us)", "p90 (us)",
+                    "p99 (us)", "max (us)")]
+        for (ph, s) in self.summary().items():
+            lines.append("{:<12}{:>9}{:>12.1f}{:>12.1f}{:>12.1f}{:>12.1f}"
+                         "{:>12.1f}".format(ph, s["count"], 1e6*s["mean"],
+                                            1e6*s["p50"], 1e6*s["p90"],
+                                            1e6*s["p99"], 1e6*s["max"]))
+        lines.append("overruns: {}".format(self.overruns))
+
+        return "\n".join(lines)
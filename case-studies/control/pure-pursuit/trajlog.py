@@ -0,0 +1,170 @@
+'''
+Binary trajectory log format, with a streaming writer and a memory-mapped
+reader
+
+File layout (little endian):
+  - fixed header: magic, format version, cart parameters L and r, controller
+    type, number of carts (0 for a single Cart), path dimensions and offset
+    of the records
+  - path: float64 array of shape (n_paths, n_waypoints, 2), n_paths being 1
+    when the path is shared
+  - records, from the 64 bytes aligned data offset: fixed width structured
+    records (t, p, p_est, u, wp_idx), see record_dtype
+
+author: Cyrill Guillemot
+email: cyrill.guillemot@gmail.com
+website: http://serial-robotics.org
+license: GNU GPL
+'''
+
+#!/usr/bin/env python
+
+from lib import *
+import os
+import struct
+
+MAGIC = b"PPTRAJ\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIdd32sIIIQ")
+
+def record_dtype(n_carts):
+    ''' Structured dtype of one record
+
+        Inputs:
+          - n_carts: number of carts, 0 for a single Cart
+    '''
+    batch = (n_carts,) if n_carts>0 else ()
+
+    return np.dtype([("t", "<f8"),
+                     ("p", "<f8", batch + (3,)),
+                     ("p_est", "<f8", batch + (3,)),
+                     ("u", "<f8", batch + (2,)),
+                     ("wp_idx", "<i8", batch)])
+
+class TrajectoryLogWriter:
+    ''' Streaming writer of trajectory logs
+
+        Detail:
+          Records are gathered in a preallocated chunk which is written to
+          the file whenever it is full, so memory usage does not grow with
+          the duration of the run
+
+        Inputs:
+          - filename: path of the log file
+          - cart: Cart or CartFleet object
+          - controller: controller object, its type and path are stored
+          - chunk: number of records buffered before writing to disk
+    '''
+    def __init__(self, filename, cart, controller, chunk=4096):
+        self.n_carts = getattr(cart, "n", 0)
+        self.dtype = record_dtype(self.n_carts)
+        self.buffer = np.zeros(chunk, dtype=self.dtype)
+        self.n_buffered = 0
+        self.n = 0
+
+        path = asarray(getattr(controller, "path", np.empty((0, 2))),
+                       dtype="<f8")
+        if path.ndim==3 and (path==path[:1]).all():
+            path = path[0]
+        if path.ndim==2:
+            path = path[None]
+
+        data_offset = HEADER.size + path.nbytes
+        data_offset += -data_offset%64
+
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(MAGIC,
+                                    VERSION,
+                                    cart.L,
+                                    cart.r,
+                                    controller.type.encode()[:32],
+                                    self.n_carts,
+                                    path.shape[0],
+                                    path.shape[1],
+                                    data_offset))
+        self.file.write(path.tobytes())
+        self.file.write(bytes(data_offset - self.file.tell()))
+
+    def write(self, t, p, p_est, u, wp_idx):
+        ''' Append one record
+        '''
+        rec = self.buffer[self.n_buffered]
+        rec["t"] = t
+        rec["p"] = p
+        rec["p_est"] = p_est
+        rec["u"] = u
+        rec["wp_idx"] = wp_idx
+
+        self.n_buffered += 1
+        self.n += 1
+        if self.n_buffered==len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        ''' Write the buffered records to disk
+        '''
+        self.file.write(self.buffer[:self.n_buffered].tobytes())
+        self.n_buffered = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryLog:
+    ''' Reader of trajectory logs
+
+        Detail:
+          The records are exposed as a read-only np.memmap structured array,
+          so slicing a log only reads the requested part from disk
+
+        Inputs:
+          - filename: path of the log file
+    '''
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+            (magic, version, self.L, self.r, ctrl_type, self.n_carts,
+             n_paths, n_wp, data_offset) = header
+            if magic!=MAGIC or version!=VERSION:
+                raise ValueError("{} is not a version {} trajectory "
+                                 "log".format(filename, VERSION))
+            self.controller_type = ctrl_type.rstrip(b"\0").decode()
+
+            path = np.frombuffer(f.read(8*2*n_paths*n_wp), dtype="<f8")
+            path = path.reshape(n_paths, n_wp, 2)
+            self.path = path[0] if n_paths==1 else path
+
+        self.dtype = record_dtype(self.n_carts)
+        size = os.path.getsize(filename) - data_offset
+        n = size//self.dtype.itemsize
+        if n>0:
+            self.records = np.memmap(filename,
+                                     dtype=self.dtype,
+                                     mode="r",
+                                     offset=data_offset,
+                                     shape=(n,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, name):
+        ''' Column of the records, as a view on the file
+        '''
+        return self.records[name]
+
+    def trajectory(self):
+        ''' True states as an array of rows [t, state]
+        '''
+        return np.hstack((self["t"][:,None],
+                          self["p"].reshape(len(self), -1)))